@@ -1,26 +1,84 @@
+import asyncio
 import logging
 from telegram import Update, Bot
 from app.services.agent import get_agent_response
-from app.config import TELEGRAM_BOT_TOKEN
+from app.services.albums import add_to_album, collect_album
+from app.config import TELEGRAM_BOT_TOKEN, MEDIA_GROUP_WINDOW
 
 logger = logging.getLogger(__name__)
 bot = Bot(token=TELEGRAM_BOT_TOKEN)
 
+async def download_file(file_id: str) -> bytes:
+    file = await bot.get_file(file_id)
+    return bytes(await file.download_as_bytearray())
+
+async def download_photo(photo) -> bytes:
+    # Take the largest size
+    return await download_file(photo[-1].file_id)
+
+async def send_response(chat_id: int, response: str):
+    if not response or not response.strip():
+        response = "Maaf, saya tidak mendapatkan respon teks dari AI. Silakan coba lagi atau periksa input Anda."
+
+    await bot.send_message(
+        chat_id=chat_id, 
+        text=response,
+        parse_mode="HTML"
+    )
+
+async def handle_media_group(update: Update):
+    """
+    Mengumpulkan foto-foto dalam satu album selama MEDIA_GROUP_WINDOW detik,
+    lalu memprosesnya sekaligus dalam satu request ke agent dan satu balasan.
+    Buffer album disimpan di Postgres, jadi foto yang diterima worker lain ikut terkumpul.
+    """
+    chat_id = update.message.chat_id
+    media_group_id = update.message.media_group_id
+
+    try:
+        claimed = await add_to_album(chat_id, media_group_id, update.message.photo[-1].file_id, update.message.caption)
+        if not claimed:
+            return
+
+        await asyncio.sleep(MEDIA_GROUP_WINDOW)
+        file_ids, captions = await collect_album(chat_id, media_group_id)
+        if not file_ids:
+            return
+
+        images = await asyncio.gather(*[download_file(file_id) for file_id in file_ids])
+        caption = "\n".join(captions)
+        response = await get_agent_response(
+            text_or_image=list(images),
+            chat_id=chat_id,
+            is_image=True,
+            caption=caption or None
+        )
+        await send_response(chat_id, response)
+    except Exception as e:
+        logger.error(f"Error handling media group: {e}")
+        await bot.send_message(
+            chat_id=chat_id,
+            text="Terjadi kesalahan sistem. Silakan coba lagi nanti."
+        )
+
 async def handle_message(update: Update):
     chat_id = update.message.chat_id
     text = update.message.text
     photo = update.message.photo
+
+    if photo and update.message.media_group_id:
+        await handle_media_group(update)
+        return
     
     try:
         response = ""
         if photo:
-            # Handle photo (take the largest one)
-            file = await bot.get_file(photo[-1].file_id)
-            img_bytes = await file.download_as_bytearray()
+            img_bytes = await download_photo(photo)
             response = await get_agent_response(
-                text_or_image=bytes(img_bytes),
+                text_or_image=img_bytes,
                 chat_id=chat_id,
-                is_image=True
+                is_image=True,
+                caption=update.message.caption
             )
         elif text:
             response = await get_agent_response(
@@ -31,14 +89,7 @@ async def handle_message(update: Update):
         else:
             response = "Maaf, saya hanya bisa memproses teks atau foto nota/struk."
 
-        if not response or not response.strip():
-            response = "Maaf, saya tidak mendapatkan respon teks dari AI. Silakan coba lagi atau periksa input Anda."
-        
-        await bot.send_message(
-            chat_id=chat_id, 
-            text=response,
-            parse_mode="HTML"
-        )
+        await send_response(chat_id, response)
     except Exception as e:
         logger.error(f"Error handling message: {e}")
         await bot.send_message(
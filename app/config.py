@@ -19,3 +19,43 @@ DB_USER = os.getenv("POSTGRES_USER", "postgres")
 DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 DB_HOST = os.getenv("POSTGRES_HOST", "db")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
+# Optional read replica for analytical tools; reads stay on the primary when unset
+DB_READ_HOST = os.getenv("POSTGRES_READ_HOST")
+DB_READ_PORT = os.getenv("POSTGRES_READ_PORT") or DB_PORT
+DB_READ_CONNECT_TIMEOUT = int(os.getenv("POSTGRES_READ_CONNECT_TIMEOUT", "2"))  # seconds
+DB_READ_RETRY_AFTER = float(os.getenv("POSTGRES_READ_RETRY_AFTER", "30"))  # seconds
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "10"))  # seconds
+DB_POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "20"))
+
+# Conversation Memory Configurations
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "1024"))
+MEMORY_SAVE_RETRIES = int(os.getenv("MEMORY_SAVE_RETRIES", "3"))
+
+# Telegram Album Configurations
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))  # seconds
+
+# Category Resolver Configurations
+CATEGORY_SIMILARITY_THRESHOLD = float(os.getenv("CATEGORY_SIMILARITY_THRESHOLD", "0.65"))
+# Per-word similarity needed on top of that, so subcategories ("Makanan Ringan") don't merge into "Makanan"
+CATEGORY_TOKEN_THRESHOLD = float(os.getenv("CATEGORY_TOKEN_THRESHOLD", "0.5"))
+CATEGORY_INDEX_TTL = float(os.getenv("CATEGORY_INDEX_TTL", "300"))  # seconds
+
+# Spending Analytics Configurations
+ANALYTICS_TTL = float(os.getenv("ANALYTICS_TTL", "600"))  # seconds
+BUDGET_ALERT_RATIO = float(os.getenv("BUDGET_ALERT_RATIO", "0.8"))
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+ANOMALY_HISTORY_DAYS = int(os.getenv("ANOMALY_HISTORY_DAYS", "90"))
+ANOMALY_MIN_DAYS = int(os.getenv("ANOMALY_MIN_DAYS", "5"))
+
+# LLM Resilience Configurations
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds per attempt
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))  # seconds per call, including retries
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))  # seconds
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))  # seconds
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "32"))
@@ -1,8 +1,97 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+import asyncpg
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from app.config import DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT
+from app.config import (
+    DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+    DB_READ_HOST, DB_READ_PORT, DB_READ_CONNECT_TIMEOUT, DB_READ_RETRY_AFTER, READ_YOUR_WRITES_WINDOW, ANALYTICS_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+READ = "read"
+PRIMARY = "primary"  # reads that must see the latest data, without counting as a write
+WRITE = "write"
+
+# --- Read/write routing ---
+# (access, chat_id) of the code currently running, set by the tool nodes from TOOL_ACCESS
+db_route = ContextVar("db_route", default=(WRITE, None))
+_last_write = {}  # chat_id -> monotonic time of its last write
+_remote_write = {}  # chat_id -> monotonic time of its last write made through another worker
+_replica_down_until = 0.0
+
+@contextmanager
+def route(access: str, chat_id=None):
+    """
+    Menjalankan blok dengan routing database `access` (READ/PRIMARY/WRITE) untuk chat_id tertentu.
+    Hanya READ yang boleh memakai replica; write dicatat oleh tool lewat mark_write setelah berhasil.
+    """
+    token = db_route.set((access, chat_id))
+    try:
+        yield
+    finally:
+        db_route.reset(token)
+
+def _prune(writes: dict, now: float, keep: float):
+    if len(writes) > 10_000:
+        for key, at in list(writes.items()):
+            if now - at > keep:
+                del writes[key]
+
+def mark_write(chat_id, age: float = 0.0, remote: bool = False):
+    """
+    Mencatat write chat_id `age` detik yang lalu (lihat chat_memory.last_write_at).
+    remote=True untuk write yang dibuat lewat worker lain, sehingga cache lokal chat ini perlu di-reload.
+    """
+    now = time.monotonic()
+    if now - age > _last_write.get(chat_id, float("-inf")):
+        _last_write[chat_id] = now - age
+    _prune(_last_write, now, READ_YOUR_WRITES_WINDOW)
+    if remote:
+        if now - age > _remote_write.get(chat_id, float("-inf")):
+            _remote_write[chat_id] = now - age
+        _prune(_remote_write, now, ANALYTICS_TTL)
+
+def last_remote_write(chat_id) -> Optional[float]:
+    """ Waktu monotonic write terakhir chat_id dari worker lain, atau None. """
+    return _remote_write.get(chat_id)
+
+def wrote_since(chat_id, since: float) -> bool:
+    """ True jika chat_id menulis di worker ini sejak waktu monotonic `since`. """
+    return _last_write.get(chat_id, float("-inf")) >= since
+
+def use_replica() -> bool:
+    """ Baca dari replica hanya jika replica dikonfigurasi, sehat, dan chat ini tidak baru saja menulis. """
+    access, chat_id = db_route.get()
+    if access != READ or not DB_READ_HOST or time.monotonic() < _replica_down_until:
+        return False
+    last = _last_write.get(chat_id)
+    return last is None or time.monotonic() - last > READ_YOUR_WRITES_WINDOW
+
+def mark_replica_down(error):
+    global _replica_down_until
+    logger.warning(f"Read replica unavailable, falling back to primary for {DB_READ_RETRY_AFTER:.0f}s: {error}")
+    _replica_down_until = time.monotonic() + DB_READ_RETRY_AFTER
 
 def get_db_connection(dbname=None):
+    if dbname is None and use_replica():
+        try:
+            return psycopg2.connect(
+                host=DB_READ_HOST,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_READ_PORT,
+                connect_timeout=DB_READ_CONNECT_TIMEOUT
+            )
+        except psycopg2.OperationalError as e:
+            mark_replica_down(e)
+
     return psycopg2.connect(
         host=DB_HOST,
         database=dbname or DB_NAME,
@@ -11,6 +100,66 @@ def get_db_connection(dbname=None):
         port=DB_PORT
     )
 
+# --- Async connection pools (asyncpg), created lazily on first use ---
+# Errors meaning the replica can't serve right now (down, restarting/in recovery, out of connections)
+REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,  # includes ConnectionDoesNotExistError
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+)
+
+async_pools = {}
+_async_pool_lock = None
+
+async def _get_pool(access: str, host: str, port: str, timeout=60):
+    global _async_pool_lock
+    if access not in async_pools:
+        if _async_pool_lock is None:
+            _async_pool_lock = asyncio.Lock()
+        async with _async_pool_lock:
+            if access not in async_pools:
+                async_pools[access] = await asyncpg.create_pool(
+                    host=host,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    port=int(port),
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=timeout
+                )
+    return async_pools[access]
+
+async def get_async_pool():
+    if use_replica():
+        try:
+            return await _get_pool(READ, DB_READ_HOST, DB_READ_PORT, timeout=DB_READ_CONNECT_TIMEOUT)
+        except REPLICA_ERRORS + (asyncpg.PostgresError,) as e:
+            mark_replica_down(e)
+    return await _get_pool(WRITE, DB_HOST, DB_PORT)
+
+async def read_query(method: str, sql: str, *args):
+    """
+    Menjalankan query baca lewat pool.<method> (fetch/fetchrow/fetchval).
+    Jika koneksi ke replica putus di tengah query, replica ditandai down dan query diulang sekali di primary.
+    """
+    pool = await get_async_pool()
+    try:
+        return await getattr(pool, method)(sql, *args)
+    except REPLICA_ERRORS as e:
+        if pool is not async_pools.get(READ):
+            raise
+        mark_replica_down(e)
+    primary = await _get_pool(WRITE, DB_HOST, DB_PORT)
+    return await getattr(primary, method)(sql, *args)
+
+async def close_async_pool():
+    for access in list(async_pools):
+        await async_pools.pop(access).close()
+
 def init_db():
     target_db = DB_NAME
     
@@ -47,6 +196,39 @@ def init_db():
     """)
     # Add column if it doesn't exist (for existing DBs)
     cursor.execute("ALTER TABLE pengeluaran ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    cursor.execute("ALTER TABLE pengeluaran ADD COLUMN IF NOT EXISTS chat_id BIGINT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS pengeluaran_chat_id_idx ON pengeluaran (chat_id, created_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS budget (
+            chat_id BIGINT,
+            category TEXT,
+            month DATE,
+            amount NUMERIC,
+            PRIMARY KEY (chat_id, category, month)
+        )
+    """)
+    # Conversation history shared by all workers, versioned for optimistic locking
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chat_memory (
+            chat_id BIGINT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            messages BYTEA NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Last expense/budget write of the chat, so read-your-writes holds across workers
+    cursor.execute("ALTER TABLE chat_memory ADD COLUMN IF NOT EXISTS last_write_at TIMESTAMP")
+    # Album photos buffered across workers (see app/services/albums.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS media_group (
+            chat_id BIGINT,
+            media_group_id TEXT,
+            file_ids TEXT[] NOT NULL,
+            captions TEXT[] NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, media_group_id)
+        )
+    """)
     conn.commit()
     cursor.close()
     conn.close()
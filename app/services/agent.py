@@ -1,34 +1,36 @@
+import asyncio
 import base64
-from typing import List, Annotated, TypedDict, Union
-from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage, RemoveMessage
+import time
+from typing import List, Annotated, Optional, TypedDict, Union
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage, SystemMessage, RemoveMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from app.config import LLM_MODEL
-from app.services.tools import tools
+from app.config import LLM_MODEL, LLM_TIMEOUT
+from app.db.database import WRITE, route, wrote_since
+from app.services.async_tools import async_tools
+from app.services.memory import aload_memory, asave_memory
+from app.services.resilience import CircuitOpenError, ResilientCaller
+from app.services.tools import TOOL_ACCESS, get_chat_id, tools
 from app.utils.parser import parse_agent_output
 
-# --- In-memory storage for chat history ---
-chat_memory = {}
-
-def get_memory(chat_id):
-    return chat_memory.get(chat_id, [])
-
-def save_memory(chat_id, messages):
-    chat_memory[chat_id] = messages
+# Shared across requests so latency stats and circuit breaker state accumulate
+llm_caller = ResilientCaller()
 
 # --- Custom ToolNode ---
 class BasicToolNode:
     def __init__(self, tools: list):
         self.tools_by_name = {tool.name: tool for tool in tools}
 
-    def __call__(self, state: dict):
+    def __call__(self, state: dict, config: RunnableConfig):
         messages = state.get("messages", [])
         last_message = messages[-1]
         outputs = []
         for tool_call in last_message.tool_calls:
             tool = self.tools_by_name[tool_call["name"]]
-            tool_output = tool.invoke(tool_call["args"])
+            with route(TOOL_ACCESS.get(tool.name, WRITE), get_chat_id(config)):
+                tool_output = tool.invoke(tool_call["args"], config)
             outputs.append(ToolMessage(
                 content=str(tool_output),
                 tool_call_id=tool_call["id"],
@@ -36,6 +38,28 @@ class BasicToolNode:
             ))
         return {"messages": outputs}
 
+class BasicAsyncToolNode(BasicToolNode):
+    """ Versi async dari BasicToolNode; tool calls dalam satu pesan dijalankan bersamaan. """
+    async def __call__(self, state: dict, config: RunnableConfig):
+        messages = state.get("messages", [])
+        last_message = messages[-1]
+        async def run(tool_call):
+            tool = self.tools_by_name[tool_call["name"]]
+            # Each gathered call runs in its own task, so the route stays local to it
+            with route(TOOL_ACCESS.get(tool.name, WRITE), get_chat_id(config)):
+                return await tool.ainvoke(tool_call["args"], config)
+
+        tool_outputs = await asyncio.gather(*[run(tool_call) for tool_call in last_message.tool_calls])
+        outputs = [
+            ToolMessage(
+                content=str(tool_output),
+                tool_call_id=tool_call["id"],
+                name=tool_call["name"]
+            )
+            for tool_call, tool_output in zip(last_message.tool_calls, tool_outputs)
+        ]
+        return {"messages": outputs}
+
 # --- State & Logic ---
 class State(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
@@ -49,70 +73,108 @@ def limit_memory(state: State):
         return {"messages": [RemoveMessage(id=m.id) for m in messages[:-10]]}
     return {"messages": []}
 
-def call_model(state: State):
-    system_prompt = """You are a financial recorder AI agent.
+SYSTEM_PROMPT = """You are a financial recorder AI agent.
 Your task is to process user input about expenses and prepare it to be stored in the database.
 
 ### Instructions:
-1. Sebelum membuat data baru, gunakan **get_recent_expenses** untuk mendapatkan `id` terakhir.
-   - Jika belum ada data (last_id=0), mulai dari id = 1.
-   - Jika ada data, id baru = last_id + 1.
-2. Gunakan **get_categories** untuk melihat kategori yang sudah pernah digunakan. 
-   **PENTING:** Jika input user memiliki arti yang mirip dengan kategori yang sudah ada (misal: 'perlengkapan rumah' mirip dengan 'Peralatan Rumah Tangga'), gunakan kategori yang SUDAH ADA agar konsisten.
+1. Untuk data baru, JANGAN isi `id`; id dibuat otomatis oleh database saat **save_expense**.
+   - Isi `id` hanya untuk mengubah data yang sudah ada (gunakan **get_recent_expenses** untuk melihat data terakhir chat ini).
+2. Kategori yang mirip dengan kategori yang sudah ada akan otomatis disamakan oleh **save_expense**, jadi tidak perlu memanggil **get_categories** sebelum menyimpan.
 3. Parse input user menjadi structured items. Gunakan format **Title Case** untuk kategori.
-4. Gunakan **save_expense** untuk menyimpan data.
+4. Gunakan **save_expense** untuk menyimpan data. Jika ada banyak item (misal dari beberapa foto nota), simpan semuanya dalam SATU panggilan save_expense.
 5. Gunakan tools lain jika user bertanya tentang total, kategori, atau pengeluaran pada waktu tertentu.
+   Gunakan **set_budget**, **get_budget_status**, dan **get_spending_insights** untuk budget dan analisis pengeluaran.
+   Jika hasil **save_expense** berisi peringatan budget atau pengeluaran tidak biasa, sampaikan ke user.
 6. Jawab dalam Bahasa Indonesia yang natural.
 """
-    model = ChatGoogleGenerativeAI(model=LLM_MODEL).bind_tools(tools)
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
-    response = model.invoke(messages)
+
+OUTAGE_MESSAGE = "Maaf, layanan AI sedang mengalami gangguan. Silakan coba lagi beberapa saat lagi."
+
+def get_model():
+    # Tool schemas are identical for the sync and async tool sets.
+    # The client's own timeout ends the HTTP request itself, and retries are left to llm_caller.
+    return ChatGoogleGenerativeAI(model=LLM_MODEL, timeout=LLM_TIMEOUT, max_retries=0).bind_tools(tools)
+
+def call_model(state: State):
+    model = get_model()
+    messages = [SystemMessage(content=SYSTEM_PROMPT)] + state["messages"]
+    try:
+        response = llm_caller.call(lambda: model.invoke(messages))
+    except CircuitOpenError:
+        # Fast path while the upstream is unhealthy
+        response = AIMessage(content=OUTAGE_MESSAGE)
+    return {"messages": [response]}
+
+async def acall_model(state: State):
+    model = get_model()
+    messages = [SystemMessage(content=SYSTEM_PROMPT)] + state["messages"]
+    try:
+        response = await llm_caller.acall(lambda: model.ainvoke(messages))
+    except CircuitOpenError:
+        response = AIMessage(content=OUTAGE_MESSAGE)
     return {"messages": [response]}
 
 def should_continue(state: State):
     last_message = state["messages"][-1]
     return "tools" if last_message.tool_calls else END
 
-workflow = StateGraph(State)
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", BasicToolNode(tools))
-workflow.add_node("limit", limit_memory)
+def build_graph(agent_node, tool_node):
+    workflow = StateGraph(State)
+    workflow.add_node("agent", agent_node)
+    workflow.add_node("tools", tool_node)
+    workflow.add_node("limit", limit_memory)
 
-workflow.add_edge(START, "agent")
-workflow.add_conditional_edges("agent", should_continue, ["tools", END])
-workflow.add_edge("tools", "limit")
-workflow.add_edge("limit", "agent")
+    workflow.add_edge(START, "agent")
+    workflow.add_conditional_edges("agent", should_continue, ["tools", END])
+    workflow.add_edge("tools", "limit")
+    workflow.add_edge("limit", "agent")
+    return workflow.compile()
 
-graph_app = workflow.compile()
+# Sync graph (blocking model & psycopg2 tools) and fully async graph (ainvoke & asyncpg tools)
+graph_app = build_graph(call_model, BasicToolNode(tools))
+async_graph_app = build_graph(acall_model, BasicAsyncToolNode(async_tools))
 
 async def get_agent_response(
-    text_or_image: Union[str, bytes],
+    text_or_image: Union[str, bytes, List[bytes]],
     chat_id: int,
-    is_image: bool = False
+    is_image: bool = False,
+    caption: Optional[str] = None
 ):
     if is_image:
-        image_data = base64.b64encode(text_or_image).decode("utf-8")
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text": "Extract data pengeluaran dari gambar ini."},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{image_data}"
-                    }
+        images = text_or_image if isinstance(text_or_image, list) else [text_or_image]
+        if len(images) > 1:
+            instruction = (
+                f"Extract data pengeluaran dari {len(images)} gambar ini. "
+                "Gabungkan semua item dan simpan dengan satu panggilan save_expense."
+            )
+        else:
+            instruction = "Extract data pengeluaran dari gambar ini."
+        if caption:
+            instruction += f"\nKeterangan dari user: {caption}"
+
+        content = [{"type": "text", "text": instruction}]
+        for img in images:
+            image_data = base64.b64encode(img).decode("utf-8")
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{image_data}"
                 }
-            ]
-        )
+            })
+        message = HumanMessage(content=content)
     else:
         message = HumanMessage(content=str(text_or_image))
     
-    memory = get_memory(chat_id)
+    memory, version = await aload_memory(chat_id)
+    turn_start = time.monotonic()
+    memory_ids = {m.id for m in memory}
     inputs = {"messages": memory + [message]}
 
     final_text = ""
     last_state = inputs
 
-    async for output in graph_app.astream(inputs):
+    config = {"configurable": {"chat_id": chat_id}}
+    async for output in async_graph_app.astream(inputs, config):
         for node_name, node_output in output.items():
             if "messages" in node_output:
                 last_state["messages"] = add_messages(last_state["messages"], node_output["messages"])
@@ -122,5 +184,6 @@ async def get_agent_response(
                 if msg.content and not msg.tool_calls:
                     final_text = parse_agent_output(msg.content)
 
-    save_memory(chat_id, last_state["messages"])
+    new_messages = [m for m in last_state["messages"] if m.id not in memory_ids]
+    await asave_memory(chat_id, last_state["messages"], version, new_messages, wrote=wrote_since(chat_id, turn_start))
     return final_text
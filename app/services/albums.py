@@ -0,0 +1,34 @@
+from typing import List, Optional, Tuple
+from app.db.database import get_async_pool
+
+# --- Album (media group) buffer shared by all workers ---
+# Telegram delivers each photo of an album as a separate update, and with several
+# workers those updates land on different processes. The first photo claims the
+# album row; the others only append their file_id, and the claiming worker
+# collects everything after MEDIA_GROUP_WINDOW.
+
+ADD_SQL = """
+    INSERT INTO media_group (chat_id, media_group_id, file_ids, captions)
+    VALUES ($1, $2, ARRAY[$3::text], ARRAY[$4::text])
+    ON CONFLICT (chat_id, media_group_id) DO UPDATE SET
+        file_ids = media_group.file_ids || EXCLUDED.file_ids,
+        captions = media_group.captions || EXCLUDED.captions
+    RETURNING (xmax = 0)
+"""
+COLLECT_SQL = "DELETE FROM media_group WHERE chat_id = $1 AND media_group_id = $2 RETURNING file_ids, captions"
+# Albums whose claiming worker died before collecting them
+CLEANUP_SQL = "DELETE FROM media_group WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '1 hour'"
+
+async def add_to_album(chat_id: int, media_group_id: str, file_id: str, caption: Optional[str]) -> bool:
+    """ Menambahkan foto ke album; True jika worker ini yang pertama (dan bertugas memproses album). """
+    pool = await get_async_pool()
+    return await pool.fetchval(ADD_SQL, chat_id, media_group_id, file_id, caption)
+
+async def collect_album(chat_id: int, media_group_id: str) -> Tuple[List[str], List[str]]:
+    """ Mengambil dan menghapus album: (file_ids, captions yang tidak kosong). """
+    pool = await get_async_pool()
+    row = await pool.fetchrow(COLLECT_SQL, chat_id, media_group_id)
+    await pool.execute(CLEANUP_SQL)
+    if not row:
+        return [], []
+    return list(row[0]), [c for c in row[1] if c]
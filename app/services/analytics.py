@@ -0,0 +1,247 @@
+import calendar
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+from app.config import ANALYTICS_TTL, BUDGET_ALERT_RATIO, ANOMALY_Z_THRESHOLD, ANOMALY_HISTORY_DAYS, ANOMALY_MIN_DAYS
+from app.db.database import PRIMARY, get_async_pool, get_db_connection, last_remote_write, route
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def parse_month(month: Optional[str]) -> date:
+    """ 'YYYY-MM' -> tanggal 1 bulan tersebut; None -> bulan ini. """
+    if not month:
+        return month_start(date.today())
+    year, mon = month.split("-")[:2]
+    return date(int(year), int(mon), 1)
+
+class ChatSeries:
+    """
+    Deret waktu harian pengeluaran satu chat.
+    matrix[c, d] = total pengeluaran kategori c pada hari origin + d.
+    """
+    def __init__(self, origin: date):
+        self.origin = origin
+        self.categories: Dict[str, int] = {}
+        self.matrix = np.zeros((0, 0))
+        self.budgets: Dict[tuple, float] = {}  # (category, month_start) -> amount
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _index(self, day: date) -> int:
+        return (day - self.origin).days
+
+    def _ensure(self, day: date):
+        """ Memperbesar matrix agar mencakup `day` (ke kiri atau ke kanan). """
+        idx = self._index(day)
+        n_cat, n_days = self.matrix.shape
+        if idx < 0:
+            self.matrix = np.hstack([np.zeros((n_cat, -idx)), self.matrix])
+            self.origin = day
+        elif idx >= n_days:
+            # Grow geometrically so daily appends stay amortized O(1)
+            grow = max(idx - n_days + 1, n_days // 2, 32)
+            self.matrix = np.hstack([self.matrix, np.zeros((n_cat, grow))])
+
+    def _row(self, category: str) -> int:
+        if category not in self.categories:
+            self.categories[category] = len(self.categories)
+            self.matrix = np.vstack([self.matrix, np.zeros((1, self.matrix.shape[1]))])
+        return self.categories[category]
+
+    def add(self, category: str, day: date, amount: float):
+        with self.lock:
+            self._ensure(day)
+            # _row may grow the matrix, so it must run before self.matrix is looked up
+            row = self._row(category)
+            self.matrix[row, self._index(day)] += amount
+
+    def add_many(self, categories: List[str], days: List[date], amounts: List[float]):
+        """ Memasukkan banyak data sekaligus (dipakai saat load dari database). """
+        if not days:
+            return
+        with self.lock:
+            self._ensure(min(days))
+            self._ensure(max(days))
+            rows = np.array([self._row(c) for c in categories])
+            cols = np.array([self._index(d) for d in days])
+            np.add.at(self.matrix, (rows, cols), np.asarray(amounts, dtype=float))
+
+    def window(self, start: date, end: date) -> np.ndarray:
+        """ Potongan matrix untuk hari start..end (inklusif), diisi nol di luar data. """
+        with self.lock:
+            self._ensure(end)
+            self._ensure(start)
+            return self.matrix[:, self._index(start):self._index(end) + 1].copy()
+
+    def month_to_date(self, day: date) -> Dict[str, float]:
+        totals = self.window(month_start(day), day).sum(axis=1)
+        return {cat: float(totals[row]) for cat, row in self.categories.items()}
+
+    def projection(self, day: date) -> Dict[str, float]:
+        """ Proyeksi total akhir bulan per kategori, linear dari rata-rata harian bulan ini. """
+        days_in_month = calendar.monthrange(day.year, day.month)[1]
+        totals = self.window(month_start(day), day).sum(axis=1) * days_in_month / day.day
+        return {cat: float(totals[row]) for cat, row in self.categories.items()}
+
+    def anomalies(self, day: date, history_days: int = ANOMALY_HISTORY_DAYS, z_threshold: float = ANOMALY_Z_THRESHOLD) -> Dict[str, float]:
+        """
+        Z-score pengeluaran hari `day` per kategori terhadap hari-hari belanja
+        (hari dengan pengeluaran > 0) dalam `history_days` hari sebelumnya.
+        Hanya kategori dengan z >= z_threshold yang dikembalikan.
+        """
+        data = self.window(day - timedelta(days=history_days), day)
+        history, current = data[:, :-1], data[:, -1]
+        active = history > 0
+        count = active.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = history.sum(axis=1) / count
+            std = np.sqrt((history ** 2).sum(axis=1) / count - mean ** 2)
+            z = np.where((count >= ANOMALY_MIN_DAYS) & (std > 0), (current - mean) / std, 0.0)
+        return {
+            cat: float(z[row]) for cat, row in self.categories.items()
+            if current[row] > 0 and z[row] >= z_threshold
+        }
+
+    def rolling_average(self, day: date, window: int) -> float:
+        """ Rata-rata pengeluaran harian selama `window` hari terakhir sampai `day`. """
+        return float(self.window(day - timedelta(days=window - 1), day).sum(axis=0).mean())
+
+    def record(self, items: List[tuple], today: Optional[date] = None) -> List[str]:
+        """
+        Menambahkan item (category, date, amount) ke deret waktu dan
+        mengembalikan daftar alert budget/anomali yang baru terpicu.
+        """
+        today = today or date.today()
+        month = month_start(today)
+        touched = {cat for cat, day, _ in items if month_start(day) == month}
+        before = self.month_to_date(today)
+        unusual_before = self.anomalies(today)
+        for cat, day, amount in items:
+            self.add(cat, day, amount)
+        after = self.month_to_date(today)
+
+        alerts = []
+        for cat in sorted(touched):
+            budget = self.budgets.get((cat, month))
+            if not budget:
+                continue
+            old_ratio, new_ratio = before.get(cat, 0.0) / budget, after[cat] / budget
+            if old_ratio < 1 <= new_ratio:
+                alerts.append(f"Budget {cat} bulan ini terlampaui: Rp {after[cat]:,.0f} dari Rp {budget:,.0f}.")
+            elif old_ratio < BUDGET_ALERT_RATIO <= new_ratio:
+                alerts.append(f"Pengeluaran {cat} sudah {new_ratio:.0%} dari budget bulan ini (Rp {budget:,.0f}).")
+
+        for cat, z in self.anomalies(today).items():
+            if cat in touched and cat not in unusual_before:
+                alerts.append(f"Pengeluaran {cat} hari ini tidak biasa (z-score {z:.1f}) dibanding {ANOMALY_HISTORY_DAYS} hari terakhir.")
+        return alerts
+
+LOAD_SERIES_SQL = "SELECT category, created_at::date, SUM(expenses) FROM pengeluaran WHERE chat_id = {0} AND expenses IS NOT NULL GROUP BY 1, 2"
+LOAD_BUDGETS_SQL = "SELECT category, month, amount FROM budget WHERE chat_id = {0}"
+UPSERT_BUDGET_SQL = "INSERT INTO budget (chat_id, category, month, amount) VALUES ({0}, {1}, {2}, {3}) ON CONFLICT (chat_id, category, month) DO UPDATE SET amount = EXCLUDED.amount"
+DELETE_BUDGET_SQL = "DELETE FROM budget WHERE chat_id = {0} AND category = {1} AND month = {2}"
+
+class SpendingAnalytics:
+    """
+    Cache deret waktu per chat. Setiap chat dimuat sekali dari tabel pengeluaran,
+    lalu diupdate incremental lewat ChatSeries.record di save_expense. Data di-reload
+    setelah ANALYTICS_TTL detik, atau lebih cepat jika chat tersebut menulis lewat worker
+    lain (chat_memory.last_write_at, dibaca di awal setiap giliran).
+    """
+    def __init__(self):
+        self.series: Dict[int, ChatSeries] = {}
+        self.lock = threading.Lock()
+
+    def _needs_reload(self, chat_id: int, series: Optional[ChatSeries]) -> bool:
+        """ Reload jika belum ada, sudah lewat TTL, atau chat ini menulis lewat worker lain setelah series dimuat. """
+        if series is None or time.monotonic() - series.loaded_at > ANALYTICS_TTL:
+            return True
+        written = last_remote_write(chat_id)
+        return written is not None and written > series.loaded_at
+
+    def get(self, chat_id: int) -> ChatSeries:
+        with self.lock:
+            series = self.series.get(chat_id)
+        if self._needs_reload(chat_id, series):
+            series = self.load(chat_id)
+        return series
+
+    def load(self, chat_id: int) -> ChatSeries:
+        # Cached for ANALYTICS_TTL and updated incrementally, so it must start from the primary
+        with route(PRIMARY):
+            conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(LOAD_SERIES_SQL.format("%s"), (chat_id,))
+            rows = cursor.fetchall()
+            cursor.execute(LOAD_BUDGETS_SQL.format("%s"), (chat_id,))
+            budgets = cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+        return self._build(chat_id, rows, budgets)
+
+    async def aget(self, chat_id: int) -> ChatSeries:
+        """ Versi async dari get. """
+        with self.lock:
+            series = self.series.get(chat_id)
+        if self._needs_reload(chat_id, series):
+            with route(PRIMARY):
+                pool = await get_async_pool()
+            rows = await pool.fetch(LOAD_SERIES_SQL.format("$1"), chat_id)
+            budgets = await pool.fetch(LOAD_BUDGETS_SQL.format("$1"), chat_id)
+            series = self._build(chat_id, rows, budgets)
+        return series
+
+    def _build(self, chat_id: int, rows, budgets) -> ChatSeries:
+        series = ChatSeries(origin=month_start(date.today()))
+        if rows:
+            categories, days, amounts = zip(*rows)
+            series.add_many(list(categories), list(days), [float(a) for a in amounts])
+        series.budgets = {(cat, month): float(amount) for cat, month, amount in budgets}
+        with self.lock:
+            self.series[chat_id] = series
+        return series
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        """ Membuang cache satu chat (atau semua chat jika chat_id None) agar di-reload dari database. """
+        with self.lock:
+            if chat_id is None:
+                self.series.clear()
+            else:
+                self.series.pop(chat_id, None)
+
+    def set_budget(self, chat_id: int, category: str, month: date, amount: float):
+        """ Menyimpan budget; amount 0 menghapus budget kategori tersebut. """
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            if amount > 0:
+                cursor.execute(UPSERT_BUDGET_SQL.format("%s", "%s", "%s", "%s"), (chat_id, category, month, amount))
+            else:
+                cursor.execute(DELETE_BUDGET_SQL.format("%s", "%s", "%s"), (chat_id, category, month))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        self._set_cached_budget(self.get(chat_id), category, month, amount)
+
+    async def aset_budget(self, chat_id: int, category: str, month: date, amount: float):
+        """ Versi async dari set_budget. """
+        pool = await get_async_pool()
+        if amount > 0:
+            await pool.execute(UPSERT_BUDGET_SQL.format("$1", "$2", "$3", "$4"), chat_id, category, month, amount)
+        else:
+            await pool.execute(DELETE_BUDGET_SQL.format("$1", "$2", "$3"), chat_id, category, month)
+        self._set_cached_budget(await self.aget(chat_id), category, month, amount)
+
+    def _set_cached_budget(self, series: ChatSeries, category: str, month: date, amount: float):
+        if amount > 0:
+            series.budgets[(category, month)] = amount
+        else:
+            series.budgets.pop((category, month), None)
+
+analytics = SpendingAnalytics()
@@ -0,0 +1,150 @@
+import json
+from typing import List, Optional
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+from app.db.database import get_async_pool, mark_write, read_query
+from app.services.analytics import analytics, parse_month
+from app.services.categories import aget_category_index
+from app.services.tools import (
+    LOCK_IDS_SQL, LAST_ID_SQL, RECENT_EXPENSE_SQL, get_chat_id, prepare_expense_rows, assign_expense_ids,
+    publish_categories, record_saved_expenses, format_recent_expense,
+    period_query, format_expense_by_period, format_budget_saved, format_budget_status, format_spending_insights
+)
+
+# Async twins of app/services/tools.py (same names & docstrings), backed by the asyncpg pool.
+
+def _text(value):
+    return None if value is None else str(value)
+
+@tool
+async def save_expense(items: List[dict], config: RunnableConfig):
+    """
+    Menyimpan data pengeluaran ke database.
+    Input items harus berupa list of dictionaries dengan key: description, category, expenses (opsional: date).
+    Untuk data baru, kosongkan id (id dibuat oleh database); isi id hanya untuk mengubah data yang sudah ada.
+    """
+    chat_id = get_chat_id(config)
+
+    try:
+        if isinstance(items, str):
+            items = json.loads(items)
+
+        # Map proposed categories onto existing canonical ones
+        index = await aget_category_index()
+        rows = prepare_expense_rows(items, index, chat_id)
+        if not rows:
+            return "Berhasil menyimpan pengeluaran."
+
+        # Make sure the chat's series is loaded before the write, so recording it below doesn't double count
+        series = await analytics.aget(chat_id) if chat_id is not None else None
+
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # New rows get MAX(id) + 1 under a table lock, so concurrent chats (and workers) can't pick the same id
+                if any(row[0] is None for row in rows):
+                    await conn.execute(LOCK_IDS_SQL)
+                    rows = assign_expense_ids(rows, await conn.fetchval(LAST_ID_SQL))
+
+                # One statement for the whole batch; rows without a date get CURRENT_TIMESTAMP,
+                # on conflict created_at is only overwritten when a date was given,
+                # and existing rows are only updated when they belong to the same chat
+                columns = list(zip(*[tuple(_text(v) for v in row) for row in rows]))
+                saved = await conn.fetch(
+                    """
+                    INSERT INTO pengeluaran (id, description, category, expenses, chat_id, created_at)
+                    SELECT id::integer, description, category, expenses::numeric, chat_id::bigint, COALESCE(created_at::timestamp, CURRENT_TIMESTAMP)
+                    FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[], $6::text[])
+                        AS t(id, description, category, expenses, chat_id, created_at)
+                    ON CONFLICT (id) DO UPDATE SET
+                        description = EXCLUDED.description,
+                        category = EXCLUDED.category,
+                        expenses = EXCLUDED.expenses,
+                        created_at = CASE WHEN $7::integer[] @> ARRAY[EXCLUDED.id] THEN EXCLUDED.created_at ELSE pengeluaran.created_at END
+                    WHERE pengeluaran.chat_id IS NOT DISTINCT FROM EXCLUDED.chat_id
+                    RETURNING id, (xmax = 0)
+                    """,
+                    *[list(col) for col in columns],
+                    [row[0] for row in rows if row[5]]
+                )
+    except Exception as e:
+        return f"Gagal menyimpan: {str(e)}"
+
+    if chat_id is not None:
+        mark_write(chat_id)
+    publish_categories(index, rows)
+    return record_saved_expenses(series, chat_id, rows, saved)
+
+@tool
+async def get_total_expense():
+    """ Mengambil total semua pengeluaran dari database. """
+    total = await read_query("fetchval", "SELECT COALESCE(SUM(expenses), 0) AS total FROM pengeluaran")
+    return f"Total pengeluaran saat ini: {total}"
+
+@tool
+async def get_expense_by_category():
+    """ Mengambil ringkasan pengeluaran per kategori. """
+    rows = await read_query("fetch", "SELECT INITCAP(category) as cat, SUM(expenses) as total FROM pengeluaran GROUP BY cat ORDER BY total DESC")
+    if not rows:
+        return "Belum ada data pengeluaran."
+    return "\n".join([f"- {row[0]}: {row[1]}" for row in rows])
+
+@tool
+async def get_recent_expenses(config: RunnableConfig):
+    """ Mengambil data pengeluaran terakhir chat ini (misalnya untuk mengoreksi data yang baru disimpan). """
+    pool = await get_async_pool()
+    row = await pool.fetchrow(RECENT_EXPENSE_SQL.format("$1"), get_chat_id(config))
+    return format_recent_expense(row)
+
+@tool
+async def get_categories():
+    """ Mengambil daftar unik semua kategori yang sudah ada di database. """
+    return (await aget_category_index()).categories()
+
+@tool
+async def get_expense_by_period(period: str):
+    """
+    Mengambil rincian pengeluaran berdasarkan periode.
+    Input period bisa berupa: 'hari ini', 'minggu ini', 'bulan ini', atau tahun (misal: '2024').
+    """
+    rows = await read_query("fetch", period_query(period))
+    return format_expense_by_period(period, rows)
+
+@tool
+async def set_budget(category: str, amount: float, config: RunnableConfig, month: Optional[str] = None):
+    """
+    Menetapkan budget pengeluaran untuk sebuah kategori.
+    Input month berformat 'YYYY-MM'; jika kosong, budget berlaku untuk bulan ini.
+    Amount 0 menghapus budget kategori tersebut.
+    """
+    if float(amount) < 0:
+        return "Gagal menetapkan budget: jumlah budget tidak boleh negatif."
+    chat_id = get_chat_id(config)
+    category = (await aget_category_index()).resolve(category)
+    target = parse_month(month)
+    await analytics.aset_budget(chat_id, category, target, float(amount))
+    if chat_id is not None:
+        mark_write(chat_id)
+    return format_budget_saved(category, target, float(amount))
+
+@tool
+async def get_budget_status(config: RunnableConfig):
+    """ Mengambil status budget bulan ini per kategori: terpakai, sisa, dan proyeksi akhir bulan. """
+    return format_budget_status(await analytics.aget(get_chat_id(config)))
+
+@tool
+async def get_spending_insights(config: RunnableConfig):
+    """ Mengambil analisis pengeluaran: rata-rata harian 7/30 hari, proyeksi bulan ini, dan pengeluaran tidak biasa hari ini. """
+    return format_spending_insights(await analytics.aget(get_chat_id(config)))
+
+async_tools = [
+    save_expense,
+    get_total_expense,
+    get_expense_by_category,
+    get_recent_expenses,
+    get_categories,
+    get_expense_by_period,
+    set_budget,
+    get_budget_status,
+    get_spending_insights
+]
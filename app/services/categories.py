@@ -0,0 +1,219 @@
+import argparse
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from app.config import CATEGORY_SIMILARITY_THRESHOLD, CATEGORY_TOKEN_THRESHOLD, CATEGORY_INDEX_TTL
+from app.db.database import PRIMARY, get_async_pool, get_db_connection, route
+
+def normalize(name: str) -> str:
+    return re.sub(r"\s+", " ", name or "").strip().lower()
+
+def ngrams(name: str, n: int = 3) -> Counter:
+    """ Character n-gram dari nama kategori, dengan padding spasi di awal & akhir. """
+    padded = f" {normalize(name)} "
+    return Counter(padded[i:i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+def tokens(name: str) -> List[str]:
+    return re.findall(r"\w+", normalize(name))
+
+def token_similarity(a: str, b: str) -> float:
+    """ Cosine character n-gram (tanpa IDF) antara dua kata. """
+    va, vb = ngrams(a), ngrams(b)
+    dot = sum(count * vb.get(gram, 0) for gram, count in va.items())
+    norm = math.sqrt(sum(c * c for c in va.values()) * sum(c * c for c in vb.values()))
+    return dot / norm if norm else 0.0
+
+def same_shape(a: str, b: str, threshold: float = CATEGORY_TOKEN_THRESHOLD) -> bool:
+    """
+    True jika a dan b terdiri dari jumlah kata yang sama dan setiap kata punya pasangan yang mirip
+    ("Minum" ~ "Minuman", "Tagihan Listrk" ~ "Tagihan Listrik"). Subkategori seperti
+    "Makanan Ringan" vs "Makanan" atau "Belanja" vs "Belanja Bulanan" tidak lolos.
+    """
+    ta, tb = tokens(a), tokens(b)
+    if len(ta) != len(tb):
+        return False
+    remaining = list(tb)
+    for token in ta:
+        best = max(remaining, key=lambda other: token_similarity(token, other))
+        if token_similarity(token, best) < threshold:
+            return False
+        remaining.remove(best)
+    return True
+
+class CategoryIndex:
+    """
+    Index similarity kategori berbasis TF-IDF character n-gram.
+    Pencarian hanya membandingkan kategori yang berbagi minimal satu n-gram
+    (inverted index), dan kategori baru ditambahkan secara incremental.
+    """
+    def __init__(self, threshold: float = CATEGORY_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.names: Dict[str, str] = {}        # normalized -> canonical display name
+        self.vectors: Dict[str, Counter] = {}  # normalized -> n-gram counts
+        self.postings: Dict[str, set] = {}     # n-gram -> set of normalized names
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def categories(self) -> List[str]:
+        return list(self.names.values())
+
+    def add(self, name: str):
+        key = normalize(name)
+        if not key:
+            return
+        with self.lock:
+            if key in self.names:
+                return
+            self.names[key] = name.strip()
+            vector = ngrams(key)
+            self.vectors[key] = vector
+            for gram in vector:
+                self.postings.setdefault(gram, set()).add(key)
+
+    def _idf(self, gram: str) -> float:
+        df = len(self.postings.get(gram, ()))
+        return math.log((1 + len(self.names)) / (1 + df)) + 1
+
+    def _weights(self, vector: Counter) -> Dict[str, float]:
+        return {gram: count * self._idf(gram) for gram, count in vector.items()}
+
+    def nearest(self, name: str) -> Tuple[Optional[str], float]:
+        """
+        Mengembalikan (kategori kanonik terdekat, skor cosine).
+        Hanya kategori dengan bentuk yang sama (lihat same_shape) yang dipertimbangkan.
+        """
+        key = normalize(name)
+        with self.lock:
+            if key in self.names:
+                return self.names[key], 1.0
+
+            query = self._weights(ngrams(key))
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+            candidates = set()
+            for gram in query:
+                candidates |= self.postings.get(gram, set())
+
+            best, best_score = None, 0.0
+            for cand in candidates:
+                if not same_shape(key, cand):
+                    continue
+                weights = self._weights(self.vectors[cand])
+                dot = sum(w * weights.get(gram, 0.0) for gram, w in query.items())
+                norm = math.sqrt(sum(w * w for w in weights.values()))
+                score = dot / (query_norm * norm) if query_norm and norm else 0.0
+                if score > best_score:
+                    best, best_score = self.names[cand], score
+            return best, best_score
+
+    def resolve(self, name: str) -> str:
+        """
+        Memetakan kategori usulan ke kategori kanonik yang sudah ada jika cukup mirip.
+        Jika tidak ada yang mirip, kategori dikembalikan dalam format Title Case.
+        """
+        if not normalize(name):
+            name = "Lain-lain"
+        best, score = self.nearest(name)
+        if best is not None and score >= self.threshold:
+            return best
+        return normalize(name).title()
+
+# --- Shared index, loaded lazily from pengeluaran ---
+category_index = CategoryIndex()
+_loaded_at = None
+
+LOAD_CATEGORIES_SQL = "SELECT category, COUNT(*) FROM pengeluaran WHERE category IS NOT NULL GROUP BY category ORDER BY COUNT(*) DESC"
+
+def load_categories():
+    # The index is shared by every chat, so never fill it from a lagging replica
+    with route(PRIMARY):
+        conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOAD_CATEGORIES_SQL)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+def _needs_refresh() -> bool:
+    return _loaded_at is None or time.monotonic() - _loaded_at > CATEGORY_INDEX_TTL
+
+def _refresh(rows):
+    """ Membangun ulang index dari database, agar kategori yang sudah di-merge ikut hilang. """
+    global category_index, _loaded_at
+    index = CategoryIndex()
+    for category, _ in rows:
+        index.add(category)
+    category_index = index
+    _loaded_at = time.monotonic()
+
+def invalidate_category_index():
+    """ Memaksa index dibangun ulang dari database pada pemakaian berikutnya. """
+    global _loaded_at
+    _loaded_at = None
+
+def get_category_index() -> CategoryIndex:
+    """ Index bersama, dibangun ulang dari database setiap CATEGORY_INDEX_TTL detik (untuk kategori dari worker lain). """
+    if _needs_refresh():
+        _refresh(load_categories())
+    return category_index
+
+async def aget_category_index() -> CategoryIndex:
+    """ Versi async dari get_category_index. """
+    if _needs_refresh():
+        with route(PRIMARY):
+            pool = await get_async_pool()
+        _refresh(await pool.fetch(LOAD_CATEGORIES_SQL))
+    return category_index
+
+# --- Batch job: merge existing duplicates ---
+def merge_duplicate_categories(dry_run: bool = False) -> Dict[str, str]:
+    """
+    Menggabungkan kategori yang mirip di tabel pengeluaran dan budget.
+    Kategori yang paling sering dipakai menjadi kategori kanonik; budget kategori
+    lama dijumlahkan ke budget kategori kanonik pada chat & bulan yang sama.
+    Mengembalikan mapping {kategori lama: kategori kanonik}.
+    """
+    index = CategoryIndex()
+    mapping = {}
+    for category, _ in load_categories():
+        canonical = index.resolve(category)
+        if canonical != category and normalize(canonical) in index.names:
+            mapping[category] = canonical
+        else:
+            index.add(category)
+
+    if mapping and not dry_run:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        pairs = [(canonical, old) for old, canonical in mapping.items()]
+        try:
+            cursor.executemany("UPDATE pengeluaran SET category = %s WHERE category = %s", pairs)
+            cursor.executemany(
+                "INSERT INTO budget (chat_id, category, month, amount) SELECT chat_id, %s, month, amount FROM budget WHERE category = %s "
+                "ON CONFLICT (chat_id, category, month) DO UPDATE SET amount = budget.amount + EXCLUDED.amount",
+                pairs
+            )
+            cursor.executemany("DELETE FROM budget WHERE category = %s", [(old,) for old in mapping])
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        invalidate_category_index()
+    return mapping
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gabungkan kategori pengeluaran yang duplikat/mirip.")
+    parser.add_argument("--dry-run", action="store_true", help="Tampilkan mapping tanpa mengubah database.")
+    args = parser.parse_args()
+
+    mapping = merge_duplicate_categories(dry_run=args.dry_run)
+    if not mapping:
+        print("Tidak ada kategori duplikat.")
+    for old, canonical in mapping.items():
+        print(f"{old} -> {canonical}")
@@ -0,0 +1,183 @@
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Tuple
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from app.config import MEMORY_CACHE_SIZE, MEMORY_SAVE_RETRIES
+from app.db.database import get_async_pool, get_db_connection, mark_write
+
+logger = logging.getLogger(__name__)
+
+# --- Local read-through cache: chat_id -> (version, messages) ---
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_get(chat_id):
+    with _cache_lock:
+        entry = _cache.get(chat_id)
+        if entry is not None:
+            _cache.move_to_end(chat_id)
+        return entry
+
+def _cache_put(chat_id, version, messages):
+    with _cache_lock:
+        _cache[chat_id] = (version, messages)
+        _cache.move_to_end(chat_id)
+        while len(_cache) > MEMORY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+# --- Serialization ---
+IMAGE_PLACEHOLDER = "[gambar]"
+
+def strip_images(messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Mengganti bagian image_url (data URL base64) dengan placeholder teks.
+    Gambar hanya dibutuhkan pada giliran saat data pengeluaran diekstrak;
+    menyimpannya membuat setiap load/save berikutnya membawa ratusan KB.
+    """
+    stripped = []
+    for message in messages:
+        if isinstance(message.content, list) and any(
+            isinstance(part, dict) and part.get("type") == "image_url" for part in message.content
+        ):
+            content = [
+                {"type": "text", "text": IMAGE_PLACEHOLDER}
+                if isinstance(part, dict) and part.get("type") == "image_url" else part
+                for part in message.content
+            ]
+            message = message.model_copy(update={"content": content})
+        stripped.append(message)
+    return stripped
+
+def serialize_messages(messages: List[BaseMessage]) -> bytes:
+    """
+    Serialize messages ke JSON yang dikompresi zlib.
+    Field kosong (None, {}, []) dibuang karena akan diisi default saat deserialisasi.
+    """
+    compact = []
+    for item in messages_to_dict(messages):
+        data = {
+            k: v for k, v in item["data"].items()
+            if k == "content" or v not in (None, {}, [])
+        }
+        compact.append({"type": item["type"], "data": data})
+    raw = json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(raw.encode("utf-8"))
+
+def deserialize_messages(payload: bytes) -> List[BaseMessage]:
+    if not payload:
+        return []
+    return messages_from_dict(json.loads(zlib.decompress(bytes(payload)).decode("utf-8")))
+
+# --- Persistent store ---
+# The age of last_write_at is computed by the database, so worker clocks don't need to agree
+LOAD_SQL = "SELECT version, CASE WHEN version = {0} THEN NULL ELSE messages END, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - last_write_at) FROM chat_memory WHERE chat_id = {1}"
+INSERT_SQL = "INSERT INTO chat_memory (chat_id, version, messages, last_write_at) VALUES ({0}, 1, {1}, CASE WHEN {2} THEN CURRENT_TIMESTAMP END) ON CONFLICT (chat_id) DO NOTHING RETURNING version"
+UPDATE_SQL = "UPDATE chat_memory SET messages = {0}, version = version + 1, updated_at = CURRENT_TIMESTAMP, last_write_at = CASE WHEN {3} THEN CURRENT_TIMESTAMP ELSE last_write_at END WHERE chat_id = {1} AND version = {2} RETURNING version"
+
+def _cached_version(chat_id: int):
+    cached = _cache_get(chat_id)
+    return cached, (cached[0] if cached else -1)
+
+def _from_row(chat_id: int, cached, row) -> Tuple[List[BaseMessage], int]:
+    if not row:
+        return [], 0
+    version, payload, write_age = row
+    if write_age is not None:
+        # Writes made through another worker count for read-your-writes here too.
+        # An unchanged cached version means this worker saved the last turn, so the write was local.
+        mark_write(chat_id, max(float(write_age), 0.0), remote=payload is not None)
+    if payload is None and cached:
+        return list(cached[1]), version
+
+    messages = deserialize_messages(payload)
+    _cache_put(chat_id, version, messages)
+    return list(messages), version
+
+def _merge(latest: List[BaseMessage], new_messages: List[BaseMessage]) -> List[BaseMessage]:
+    latest_ids = {m.id for m in latest}
+    return latest + [m for m in new_messages if m.id not in latest_ids]
+
+def load_memory(chat_id: int) -> Tuple[List[BaseMessage], int]:
+    """
+    Mengambil history chat beserta versinya.
+    Payload hanya dibaca dari database jika versi di cache lokal sudah basi.
+    """
+    cached, cached_version = _cached_version(chat_id)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LOAD_SQL.format("%s", "%s"), (cached_version, chat_id))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+    return _from_row(chat_id, cached, row)
+
+def _write_memory(chat_id: int, payload: bytes, version: int, wrote: bool):
+    """ Menulis history jika versi di database masih sama (optimistic locking). """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if version == 0:
+            cursor.execute(INSERT_SQL.format("%s", "%s", "%s"), (chat_id, payload, wrote))
+        else:
+            cursor.execute(UPDATE_SQL.format("%s", "%s", "%s", "%s"), (payload, chat_id, version, wrote))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_memory(chat_id: int, messages: List[BaseMessage], version: int, new_messages: List[BaseMessage], wrote: bool = False) -> int:
+    """
+    Menyimpan history chat dengan versi yang didapat dari load_memory.
+    Jika proses lain sudah menulis lebih dulu, new_messages (pesan dari giliran ini)
+    ditambahkan ke history terbaru lalu penulisan diulang.
+    Payload gambar tidak ikut disimpan (lihat strip_images).
+    wrote=True mencatat bahwa giliran ini menulis data (last_write_at, untuk read-your-writes).
+    """
+    messages, new_messages = strip_images(messages), strip_images(new_messages)
+    for _ in range(MEMORY_SAVE_RETRIES):
+        new_version = _write_memory(chat_id, serialize_messages(messages), version, wrote)
+        if new_version is not None:
+            _cache_put(chat_id, new_version, messages)
+            return new_version
+
+        logger.warning(f"Memory conflict for chat {chat_id} at version {version}, merging.")
+        latest, version = load_memory(chat_id)
+        messages = _merge(latest, new_messages)
+
+    raise RuntimeError(f"Gagal menyimpan memory chat {chat_id}: terlalu banyak konflik.")
+
+# --- Async store (asyncpg) ---
+async def aload_memory(chat_id: int) -> Tuple[List[BaseMessage], int]:
+    """ Versi async dari load_memory. """
+    cached, cached_version = _cached_version(chat_id)
+    pool = await get_async_pool()
+    row = await pool.fetchrow(LOAD_SQL.format("$1", "$2"), cached_version, chat_id)
+    return _from_row(chat_id, cached, tuple(row) if row else None)
+
+async def _awrite_memory(chat_id: int, payload: bytes, version: int, wrote: bool):
+    pool = await get_async_pool()
+    if version == 0:
+        return await pool.fetchval(INSERT_SQL.format("$1", "$2", "$3"), chat_id, payload, wrote)
+    return await pool.fetchval(UPDATE_SQL.format("$1", "$2", "$3", "$4"), payload, chat_id, version, wrote)
+
+async def asave_memory(chat_id: int, messages: List[BaseMessage], version: int, new_messages: List[BaseMessage], wrote: bool = False) -> int:
+    """ Versi async dari save_memory. """
+    messages, new_messages = strip_images(messages), strip_images(new_messages)
+    for _ in range(MEMORY_SAVE_RETRIES):
+        new_version = await _awrite_memory(chat_id, serialize_messages(messages), version, wrote)
+        if new_version is not None:
+            _cache_put(chat_id, new_version, messages)
+            return new_version
+
+        logger.warning(f"Memory conflict for chat {chat_id} at version {version}, merging.")
+        latest, version = await aload_memory(chat_id)
+        messages = _merge(latest, new_messages)
+
+    raise RuntimeError(f"Gagal menyimpan memory chat {chat_id}: terlalu banyak konflik.")
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Optional
+from app.config import (
+    LLM_TIMEOUT, LLM_DEADLINE, LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY,
+    LLM_HEDGE, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_DELAY,
+    LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN, LLM_MAX_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """ Dilempar saat circuit breaker terbuka (upstream dianggap sedang bermasalah). """
+
+class CircuitBreaker:
+    """
+    Circuit breaker sederhana: terbuka setelah `threshold` kegagalan berturut-turut,
+    lalu mengizinkan satu panggilan percobaan (half-open) setiap `cooldown` detik.
+    """
+    def __init__(self, threshold: int = LLM_BREAKER_THRESHOLD, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # Half-open: let this call through, block the rest for another cooldown
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit breaker opened after {self.failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+class ResilientCaller:
+    """
+    Membungkus panggilan ke upstream (LLM) dengan:
+    - timeout per attempt dan deadline total per panggilan,
+    - retry dengan exponential backoff + full jitter,
+    - hedging: attempt kedua dikirim jika attempt pertama lebih lambat dari p95 latency,
+    - circuit breaker yang langsung gagal saat upstream sedang bermasalah.
+    """
+    def __init__(
+        self,
+        timeout: float = LLM_TIMEOUT,
+        deadline: float = LLM_DEADLINE,
+        max_retries: int = LLM_MAX_RETRIES,
+        base_delay: float = LLM_RETRY_BASE_DELAY,
+        hedge: bool = LLM_HEDGE,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+        breaker: Optional[CircuitBreaker] = None,
+        max_workers: int = LLM_MAX_WORKERS
+    ):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = deque(maxlen=200)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """ Latency persentil `hedge_percentile` dari panggilan sukses terakhir, atau None jika belum cukup data. """
+        if not self.hedge or len(self.latencies) < 20:
+            return None
+        samples = sorted(self.latencies)
+        return max(samples[int(len(samples) * self.hedge_percentile) - 1], self.hedge_min_delay)
+
+    def _release(self, _future):
+        with self.in_flight_lock:
+            self.in_flight -= 1
+
+    def _submit(self, fn: Callable) -> Future:
+        """
+        Menjalankan `fn` di executor, atau di thread baru jika semua worker sedang terpakai.
+        Attempt yang timeout tetap memegang thread-nya sampai request selesai; tanpa overflow,
+        attempt berikutnya akan mengantri dan ikut timeout walaupun upstream sehat.
+        """
+        with self.in_flight_lock:
+            saturated = self.in_flight >= self.max_workers
+            self.in_flight += 1
+        if not saturated:
+            future = self.executor.submit(fn)
+        else:
+            future = Future()
+            def run():
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    future.set_result(fn())
+                except BaseException as e:
+                    future.set_exception(e)
+            threading.Thread(target=run, name="llm-overflow", daemon=True).start()
+        future.add_done_callback(self._release)
+        return future
+
+    def _attempt(self, fn: Callable, timeout: float):
+        start = time.monotonic()
+        pending = {self._submit(fn)}
+
+        delay = self.hedge_delay()
+        if delay is not None and delay < timeout:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                pending.add(self._submit(fn))
+
+        error = None
+        while pending:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.latencies.append(time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"LLM call exceeded {timeout:.1f}s")
+
+    def call(self, fn: Callable):
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM upstream is unavailable.")
+
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            remaining = self.deadline - (time.monotonic() - start)
+            try:
+                result = self._attempt(fn, min(self.timeout, remaining))
+                self.breaker.success()
+                return result
+            except Exception as e:
+                logger.warning(f"LLM call failed (attempt {attempt + 1}): {e}")
+                error = e
+
+            backoff = random.uniform(0, self.base_delay * 2 ** attempt)
+            if attempt == self.max_retries or time.monotonic() - start + backoff >= self.deadline:
+                break
+            time.sleep(backoff)
+
+        self.breaker.failure()
+        raise error
+
+    async def _aattempt(self, fn: Callable[[], Awaitable], timeout: float):
+        start = time.monotonic()
+        pending = {asyncio.ensure_future(fn())}
+
+        delay = self.hedge_delay()
+        if delay is not None and delay < timeout:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                pending.add(asyncio.ensure_future(fn()))
+
+        error = None
+        try:
+            while pending:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.append(time.monotonic() - start)
+                        return task.result()
+                    error = task.exception()
+        finally:
+            # Unlike threads, slow or hung coroutines can actually be cancelled
+            for task in pending:
+                task.cancel()
+
+        if error is not None and not pending:
+            raise error
+        raise TimeoutError(f"LLM call exceeded {timeout:.1f}s")
+
+    async def acall(self, fn: Callable[[], Awaitable]):
+        """ Versi async dari call; `fn` mengembalikan coroutine baru setiap dipanggil. """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM upstream is unavailable.")
+
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            remaining = self.deadline - (time.monotonic() - start)
+            try:
+                result = await self._aattempt(fn, min(self.timeout, remaining))
+                self.breaker.success()
+                return result
+            except Exception as e:
+                logger.warning(f"LLM call failed (attempt {attempt + 1}): {e}")
+                error = e
+
+            backoff = random.uniform(0, self.base_delay * 2 ** attempt)
+            if attempt == self.max_retries or time.monotonic() - start + backoff >= self.deadline:
+                break
+            await asyncio.sleep(backoff)
+
+        self.breaker.failure()
+        raise error
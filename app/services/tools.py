@@ -1,47 +1,219 @@
 import json
-from typing import List
+import logging
+from datetime import date
+from typing import List, Optional
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from psycopg2.extras import RealDictCursor
-from app.db.database import get_db_connection
+from psycopg2.extras import RealDictCursor, execute_values
+from app.db.database import PRIMARY, READ, WRITE, get_db_connection, mark_write
+from app.services.analytics import analytics, month_start, parse_month
+from app.services.categories import CategoryIndex, get_category_index, normalize
 
-@tool
-def save_expense(items: List[dict]):
+logger = logging.getLogger(__name__)
+
+def get_chat_id(config: RunnableConfig):
+    return (config or {}).get("configurable", {}).get("chat_id")
+
+# --- Helpers shared with app/services/async_tools.py ---
+def prepare_expense_rows(items: List[dict], index, chat_id):
+    """
+    Menyamakan kategori ke kategori kanonik dan menghapus id duplikat (yang terakhir menang)
+    agar batched upsert tidak menyentuh baris yang sama dua kali.
+    Item tanpa id adalah data baru; id-nya diberikan oleh assign_expense_ids di dalam transaksi.
+    Kategori baru belum masuk ke index bersama; panggil publish_categories setelah commit.
+    Hasil: list of (id, description, category, expenses, chat_id, date).
+    """
+    pending = CategoryIndex(index.threshold)
+    new_rows, updates = [], {}
+    for item in items:
+        category = index.resolve(item.get("category") or "Lain-lain")
+        if normalize(category) not in index.names:
+            # New category: keep its variants consistent within this batch only
+            category = pending.resolve(category)
+            pending.add(category)
+        row = (item.get("id"), item.get("description"), category, item.get("expenses"), chat_id, item.get("date"))
+        if row[0] is None:
+            new_rows.append(row)
+        else:
+            updates[int(row[0])] = (int(row[0]),) + row[1:]
+    return new_rows + list(updates.values())
+
+# Serializes id allocation with other inserts; MAX(id) is read from the primary key index
+LOCK_IDS_SQL = "LOCK TABLE pengeluaran IN SHARE ROW EXCLUSIVE MODE"
+LAST_ID_SQL = "SELECT COALESCE(MAX(id), 0) FROM pengeluaran"
+
+def assign_expense_ids(rows, last_id: int):
+    """ Memberi id berurutan setelah last_id ke baris baru (id None). """
+    assigned = []
+    for row in rows:
+        if row[0] is None:
+            last_id += 1
+            row = (last_id,) + row[1:]
+        assigned.append(row)
+    return assigned
+
+def publish_categories(index, rows):
+    """ Menambahkan kategori dari baris yang sudah di-commit ke index bersama. """
+    for row in rows:
+        index.add(row[2])
+
+def record_saved_expenses(series, chat_id, rows, saved):
     """
-    Menyimpan data pengeluaran baru ke database.
-    Input items harus berupa list of dictionaries dengan key: id, description, category, expenses.
+    Mengupdate deret waktu analytics setelah save_expense (yang sudah di-commit) dan menyusun pesan hasil + alert.
+    `saved` berisi (id, inserted) dari RETURNING; baris milik chat lain tidak diubah dan tidak ada di sini.
+    Kegagalan analytics hanya di-log, karena datanya sudah tersimpan.
     """
-    if isinstance(items, str):
-        items = json.loads(items)
+    saved_ids = {row[0] for row in saved}
+    stored = [row for row in rows if row[0] in saved_ids]
+    alerts = []
+    if series is not None:
+        try:
+            alerts = series.record([
+                (row[2], date.fromisoformat(str(row[5])[:10]) if row[5] else date.today(), float(row[3] or 0))
+                for row in stored
+            ])
+        except Exception:
+            logger.exception(f"Failed to update analytics for chat {chat_id}.")
+            analytics.invalidate(chat_id)
+        if not all(row[1] for row in saved):
+            # Existing rows were overwritten and their old values are unknown, so reload this chat lazily
+            analytics.invalidate(chat_id)
+
+    res = [f"Berhasil menyimpan pengeluaran (id: {', '.join(str(row[0]) for row in stored) or '-'})."]
+    rejected = [str(row[0]) for row in rows if row[0] not in saved_ids]
+    if rejected:
+        res.append(f"Data dengan id {', '.join(rejected)} bukan milik chat ini, tidak diubah.")
+    return "\n".join(res + alerts)
+
+RECENT_EXPENSE_SQL = "SELECT id, description, category, expenses FROM pengeluaran WHERE chat_id IS NOT DISTINCT FROM {0} ORDER BY id DESC LIMIT 1"
+
+def format_recent_expense(row):
+    if not row:
+        return json.dumps({"status": "empty"})
+    return json.dumps({"status": "exists", "id": row["id"], "description": row["description"], "category": row["category"], "expenses": float(row["expenses"])})
+
+def period_query(period: str) -> str:
+    query = "SELECT description, category, expenses, created_at::date FROM pengeluaran WHERE "
+    if period == "hari ini":
+        query += "created_at::date = CURRENT_DATE"
+    elif period == "minggu ini":
+        query += "created_at >= CURRENT_DATE - INTERVAL '7 days'"
+    elif period == "bulan ini":
+        query += "EXTRACT(MONTH FROM created_at) = EXTRACT(MONTH FROM CURRENT_DATE) AND EXTRACT(YEAR FROM created_at) = EXTRACT(YEAR FROM CURRENT_DATE)"
+    else:
+        # Asumsikan input tahun atau format spesifik lainnya bisa dikembangkan
+        query += "TRUE"
         
+    query += " ORDER BY created_at DESC"
+    return query
+
+def format_expense_by_period(period: str, rows) -> str:
+    if not rows:
+        return f"Tidak ada data pengeluaran untuk periode {period}."
+    
+    res = [f"Rincian pengeluaran {period}:"]
+    for row in rows:
+        res.append(f"- [{row[3]}] {row[0]} ({row[1]}): Rp {row[2]:,.0f}")
+    return "\n".join(res)
+
+def format_budget_saved(category: str, month: date, amount: float) -> str:
+    if amount > 0:
+        return f"Budget {category} untuk {month:%Y-%m} ditetapkan: Rp {amount:,.0f}."
+    return f"Budget {category} untuk {month:%Y-%m} dihapus."
+
+def format_budget_status(series) -> str:
+    today = date.today()
+    budgets = {cat: amount for (cat, month), amount in series.budgets.items() if month == month_start(today) and amount > 0}
+    if not budgets:
+        return "Belum ada budget untuk bulan ini."
+
+    spent = series.month_to_date(today)
+    projected = series.projection(today)
+    res = [f"Status budget {today:%Y-%m}:"]
+    for cat, budget in sorted(budgets.items()):
+        used = spent.get(cat, 0.0)
+        res.append(
+            f"- {cat}: Rp {used:,.0f} / Rp {budget:,.0f} ({used / budget:.0%}), "
+            f"sisa Rp {budget - used:,.0f}, proyeksi akhir bulan Rp {projected.get(cat, 0.0):,.0f}"
+        )
+    return "\n".join(res)
+
+def format_spending_insights(series) -> str:
+    today = date.today()
+    projected = series.projection(today)
+    anomalies = series.anomalies(today)
+
+    res = [
+        f"Rata-rata harian 7 hari terakhir: Rp {series.rolling_average(today, 7):,.0f}",
+        f"Rata-rata harian 30 hari terakhir: Rp {series.rolling_average(today, 30):,.0f}",
+        f"Total bulan ini: Rp {sum(series.month_to_date(today).values()):,.0f}, proyeksi akhir bulan: Rp {sum(projected.values()):,.0f}",
+    ]
+    for cat, z in anomalies.items():
+        res.append(f"- Pengeluaran {cat} hari ini tidak biasa (z-score {z:.1f}).")
+    return "\n".join(res)
+
+@tool
+def save_expense(items: List[dict], config: RunnableConfig):
+    """
+    Menyimpan data pengeluaran ke database.
+    Input items harus berupa list of dictionaries dengan key: description, category, expenses (opsional: date).
+    Untuk data baru, kosongkan id (id dibuat oleh database); isi id hanya untuk mengubah data yang sudah ada.
+    """
+    chat_id = get_chat_id(config)
+
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        for item in items:
-            category = item.get("category", "Lain-lain")
-            if category:
-                category = category.strip().title()
-            
-            # Use provided date or CURRENT_TIMESTAMP
-            date_val = item.get("date") # Expected format: 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'
-            
-            if date_val:
-                cursor.execute(
-                    "INSERT INTO pengeluaran (id, description, category, expenses, created_at) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses, created_at = EXCLUDED.created_at",
-                    (item.get("id"), item.get("description"), category, item.get("expenses"), date_val)
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO pengeluaran (id, description, category, expenses) VALUES (%s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses",
-                    (item.get("id"), item.get("description"), category, item.get("expenses"))
-                )
+        if isinstance(items, str):
+            items = json.loads(items)
+
+        # Map proposed categories onto existing canonical ones
+        index = get_category_index()
+        rows = prepare_expense_rows(items, index, chat_id)
+
+        # Make sure the chat's series is loaded before the write, so recording it below doesn't double count
+        series = analytics.get(chat_id) if chat_id is not None else None
+
+        # New rows get MAX(id) + 1 under a table lock, so concurrent chats (and workers) can't pick the same id
+        if any(row[0] is None for row in rows):
+            cursor.execute(LOCK_IDS_SQL)
+            cursor.execute(LAST_ID_SQL)
+            rows = assign_expense_ids(rows, cursor.fetchone()[0])
+
+        # Use provided date or CURRENT_TIMESTAMP
+        # Expected date format: 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'
+        dated = [row for row in rows if row[5]]
+        undated = [row[:5] for row in rows if not row[5]]
+
+        # Existing rows are only updated when they belong to the same chat.
+        # (xmax = 0) is true for inserted rows and false for rows updated by ON CONFLICT
+        saved = []
+        if dated:
+            saved += execute_values(
+                cursor,
+                "INSERT INTO pengeluaran (id, description, category, expenses, chat_id, created_at) VALUES %s ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses, created_at = EXCLUDED.created_at WHERE pengeluaran.chat_id IS NOT DISTINCT FROM EXCLUDED.chat_id RETURNING id, (xmax = 0)",
+                dated,
+                fetch=True
+            )
+        if undated:
+            saved += execute_values(
+                cursor,
+                "INSERT INTO pengeluaran (id, description, category, expenses, chat_id) VALUES %s ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses WHERE pengeluaran.chat_id IS NOT DISTINCT FROM EXCLUDED.chat_id RETURNING id, (xmax = 0)",
+                undated,
+                fetch=True
+            )
         conn.commit()
-        return "Berhasil menyimpan pengeluaran."
     except Exception as e:
         return f"Gagal menyimpan: {str(e)}"
     finally:
         cursor.close()
         conn.close()
 
+    if chat_id is not None:
+        mark_write(chat_id)
+    publish_categories(index, rows)
+    return record_saved_expenses(series, chat_id, rows, saved)
+
 @tool
 def get_total_expense():
     """ Mengambil total semua pengeluaran dari database. """
@@ -67,28 +239,20 @@ def get_expense_by_category():
     return "\n".join([f"- {row[0]}: {row[1]}" for row in rows])
 
 @tool
-def get_recent_expenses():
-    """ Mengambil data pengeluaran terakhir untuk menentukan ID berikutnya. """
+def get_recent_expenses(config: RunnableConfig):
+    """ Mengambil data pengeluaran terakhir chat ini (misalnya untuk mengoreksi data yang baru disimpan). """
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT id, description, category, expenses FROM pengeluaran ORDER BY id DESC LIMIT 1")
+    cursor.execute(RECENT_EXPENSE_SQL.format("%s"), (get_chat_id(config),))
     row = cursor.fetchone()
     cursor.close()
     conn.close()
-    if not row:
-        return json.dumps({"status": "empty", "last_id": 0})
-    return json.dumps({"status": "exists", "id": row["id"], "description": row["description"], "category": row["category"], "expenses": float(row["expenses"])})
+    return format_recent_expense(row)
 
 @tool
 def get_categories():
     """ Mengambil daftar unik semua kategori yang sudah ada di database. """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT category FROM pengeluaran")
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return [row[0] for row in rows] if rows else []
+    return get_category_index().categories()
 
 @tool
 def get_expense_by_period(period: str):
@@ -98,32 +262,51 @@ def get_expense_by_period(period: str):
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    query = "SELECT description, category, expenses, created_at::date FROM pengeluaran WHERE "
-    if period == "hari ini":
-        query += "created_at::date = CURRENT_DATE"
-    elif period == "minggu ini":
-        query += "created_at >= CURRENT_DATE - INTERVAL '7 days'"
-    elif period == "bulan ini":
-        query += "EXTRACT(MONTH FROM created_at) = EXTRACT(MONTH FROM CURRENT_DATE) AND EXTRACT(YEAR FROM created_at) = EXTRACT(YEAR FROM CURRENT_DATE)"
-    else:
-        # Asumsikan input tahun atau format spesifik lainnya bisa dikembangkan
-        query += "TRUE"
-        
-    query += " ORDER BY created_at DESC"
-    
-    cursor.execute(query)
+    cursor.execute(period_query(period))
     rows = cursor.fetchall()
     cursor.close()
     conn.close()
-    
-    if not rows:
-        return f"Tidak ada data pengeluaran untuk periode {period}."
-    
-    res = [f"Rincian pengeluaran {period}:"]
-    for row in rows:
-        res.append(f"- [{row[3]}] {row[0]} ({row[1]}): Rp {row[2]:,.0f}")
-    return "\n".join(res)
+    return format_expense_by_period(period, rows)
+
+@tool
+def set_budget(category: str, amount: float, config: RunnableConfig, month: Optional[str] = None):
+    """
+    Menetapkan budget pengeluaran untuk sebuah kategori.
+    Input month berformat 'YYYY-MM'; jika kosong, budget berlaku untuk bulan ini.
+    Amount 0 menghapus budget kategori tersebut.
+    """
+    if float(amount) < 0:
+        return "Gagal menetapkan budget: jumlah budget tidak boleh negatif."
+    chat_id = get_chat_id(config)
+    category = get_category_index().resolve(category)
+    target = parse_month(month)
+    analytics.set_budget(chat_id, category, target, float(amount))
+    if chat_id is not None:
+        mark_write(chat_id)
+    return format_budget_saved(category, target, float(amount))
+
+@tool
+def get_budget_status(config: RunnableConfig):
+    """ Mengambil status budget bulan ini per kategori: terpakai, sisa, dan proyeksi akhir bulan. """
+    return format_budget_status(analytics.get(get_chat_id(config)))
+
+@tool
+def get_spending_insights(config: RunnableConfig):
+    """ Mengambil analisis pengeluaran: rata-rata harian 7/30 hari, proyeksi bulan ini, dan pengeluaran tidak biasa hari ini. """
+    return format_spending_insights(analytics.get(get_chat_id(config)))
+
+# Database routing per tool: READ tools may use the replica, PRIMARY and WRITE tools always use the primary
+TOOL_ACCESS = {
+    "save_expense": WRITE,
+    "get_total_expense": READ,
+    "get_expense_by_category": READ,
+    "get_recent_expenses": PRIMARY,  # a row saved a moment ago must be visible
+    "get_categories": READ,
+    "get_expense_by_period": READ,
+    "set_budget": WRITE,
+    "get_budget_status": READ,
+    "get_spending_insights": READ
+}
 
 tools = [
     save_expense, 
@@ -131,5 +314,8 @@ tools = [
     get_expense_by_category, 
     get_recent_expenses, 
     get_categories, 
-    get_expense_by_period
+    get_expense_by_period,
+    set_budget,
+    get_budget_status,
+    get_spending_insights
 ]
@@ -0,0 +1,91 @@
+"""
+Benchmark analytics per chat dengan data sintetis (tanpa database).
+
+Jalankan dari root repo:
+    python -m benchmarks.bench_analytics --chats 1000 --years 3
+
+Sebelum benchmark, check_record menjalankan beberapa pengecekan regresi (assert).
+"""
+import argparse
+import statistics
+import time
+from datetime import date, timedelta
+import numpy as np
+from app.services.analytics import ChatSeries, month_start
+
+CATEGORIES = ["Makanan", "Minuman", "Transportasi", "Belanja", "Hiburan", "Kesehatan", "Tagihan", "Pendidikan"]
+
+def build_series(rng, start: date, n_days: int, per_day: int) -> ChatSeries:
+    n = n_days * per_day
+    days = [start + timedelta(days=int(d)) for d in rng.integers(0, n_days, n)]
+    categories = [CATEGORIES[i] for i in rng.integers(0, len(CATEGORIES), n)]
+    amounts = rng.gamma(2.0, 25000.0, n).tolist()
+    series = ChatSeries(origin=month_start(date.today()))
+    series.add_many(categories, days, amounts)
+    for cat in CATEGORIES:
+        series.budgets[(cat, month_start(date.today()))] = 1_500_000
+    return series
+
+def check_record():
+    """ record dengan kategori yang belum pernah ada (matrix harus bertambah satu baris). """
+    today = date.today()
+    series = ChatSeries(origin=month_start(today))
+    series.record([("Makanan", today, 20000.0)], today)
+    series.record([("Makanan", today, 5000.0), ("Parkir", today, 3000.0)], today)
+    assert series.matrix.shape[0] == 2
+    assert series.month_to_date(today) == {"Makanan": 25000.0, "Parkir": 3000.0}
+
+    # New category on a day before the current origin (matrix grows both ways)
+    earlier = month_start(today) - timedelta(days=40)
+    series.add("Hiburan", earlier, 50000.0)
+    assert float(series.window(earlier, earlier)[series.categories["Hiburan"]][0]) == 50000.0
+    print("check_record ok")
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[max(int(len(samples) * 0.95) - 1, 0)]
+    print(f"{name:<22} p50={statistics.median(samples):.3f}ms p95={p95:.3f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--per-day", type=int, default=3)
+    args = parser.parse_args()
+
+    check_record()
+    rng = np.random.default_rng(0)
+    today = date.today()
+    n_days = 365 * args.years
+    start = today - timedelta(days=n_days - 1)
+
+    t0 = time.perf_counter()
+    chats = [build_series(rng, start, n_days, args.per_day) for _ in range(args.chats)]
+    elapsed = time.perf_counter() - t0
+    rows = args.chats * n_days * args.per_day
+    print(f"loaded {args.chats} chats / {rows:,} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)")
+    print(f"matrix memory: {sum(s.matrix.nbytes for s in chats) / 1e6:.1f} MB")
+
+    record, status, insights = [], [], []
+    for series in chats:
+        t = time.perf_counter()
+        series.record([(CATEGORIES[0], today, 35000.0), (CATEGORIES[1], today, 12000.0)], today)
+        record.append((time.perf_counter() - t) * 1000)
+
+        t = time.perf_counter()
+        series.month_to_date(today)
+        series.projection(today)
+        status.append((time.perf_counter() - t) * 1000)
+
+        t = time.perf_counter()
+        series.rolling_average(today, 7)
+        series.rolling_average(today, 30)
+        series.anomalies(today)
+        insights.append((time.perf_counter() - t) * 1000)
+
+    report("record + alerts", record)
+    report("budget status", status)
+    report("spending insights", insights)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark jumlah update yang bisa diproses bersamaan per proses:
+graph sync (model.invoke + psycopg2, dijalankan di thread executor) vs graph async (ainvoke + asyncpg).
+
+LLM diganti fake model dengan latency tetap; tools memakai Postgres sungguhan (butuh init_db).
+Jalankan dari root repo:
+    python -m benchmarks.bench_concurrency --updates 200 --latency 0.3
+"""
+import argparse
+import asyncio
+import time
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+import app.services.agent as agent
+from app.db.database import close_async_pool, get_db_connection
+from app.services.resilience import ResilientCaller
+
+CHAT_BASE = -1_000_000
+
+class FakeModel:
+    """ Alur satu update: get_recent_expenses -> save_expense -> jawaban akhir. """
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def respond(self, messages):
+        last = messages[-1]
+        if isinstance(last, HumanMessage):
+            return AIMessage(content="", tool_calls=[{"name": "get_recent_expenses", "args": {}, "id": "recent"}])
+        if isinstance(last, ToolMessage) and last.name == "get_recent_expenses":
+            item = {"description": "Nasi ayam", "category": "Makanan", "expenses": 15000}
+            return AIMessage(content="", tool_calls=[{"name": "save_expense", "args": {"items": [item]}, "id": "save"}])
+        return AIMessage(content="Pengeluaran sudah dicatat.")
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        return self.respond(messages)
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.latency)
+        return self.respond(messages)
+
+async def run_updates(graph, updates: int):
+    async def one(i):
+        start = time.perf_counter()
+        inputs = {"messages": [HumanMessage(content="beli nasi ayam 15rb")]}
+        async for _ in graph.astream(inputs, {"configurable": {"chat_id": CHAT_BASE - i}}):
+            pass
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*[one(i) for i in range(updates)]))
+    elapsed = time.perf_counter() - start
+    return elapsed, latencies
+
+def report(name, updates, elapsed, latencies):
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(f"{name:<6} {updates} updates in {elapsed:.2f}s -> {updates / elapsed:.1f} updates/s, p95 latency {p95:.2f}s")
+
+def cleanup():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM pengeluaran WHERE chat_id <= %s", (CHAT_BASE,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latency fake LLM per panggilan (detik).")
+    args = parser.parse_args()
+
+    model = FakeModel(args.latency)
+    agent.get_model = lambda: model
+    try:
+        for name, graph in (("sync", agent.graph_app), ("async", agent.async_graph_app)):
+            # Fresh caller per run, so latency samples (hedge delay) and breaker state don't carry over
+            agent.llm_caller = ResilientCaller()
+            report(name, args.updates, *await run_updates(graph, args.updates))
+    finally:
+        await close_async_pool()
+        cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Benchmark overhead persistensi memory per giliran chat.
+
+Jalankan dari root repo:
+    python -m benchmarks.bench_memory            # serialisasi saja
+    python -m benchmarks.bench_memory --db       # + load/save ke Postgres (butuh init_db)
+    python -m benchmarks.bench_memory --images 3 # history dengan 3 foto struk per giliran
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import time
+import uuid
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, messages_to_dict
+from app.services.memory import deserialize_messages, serialize_messages, strip_images
+
+def receipt_message(images: int, size: int):
+    """ Pesan foto seperti di get_agent_response; byte acak ~ JPEG (tidak bisa dikompresi). """
+    content = [{"type": "text", "text": f"Extract data pengeluaran dari {images} gambar ini."}]
+    for _ in range(images):
+        data = base64.b64encode(os.urandom(size)).decode("utf-8")
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{data}"}})
+    return HumanMessage(content=content, id=str(uuid.uuid4()))
+
+def build_history(turns: int, images: int = 0, image_size: int = 150_000):
+    messages = []
+    for i in range(turns):
+        call_id = str(uuid.uuid4())
+        if images:
+            human = receipt_message(images, image_size)
+        else:
+            human = HumanMessage(content=f"Beli nasi ayam {15000 + i} untuk makan siang", id=str(uuid.uuid4()))
+        messages += [
+            human,
+            AIMessage(
+                content="",
+                tool_calls=[{"name": "save_expense", "args": {"items": [{"id": i, "description": "Nasi ayam", "category": "Makanan", "expenses": 15000 + i}]}, "id": call_id}],
+                id=str(uuid.uuid4())
+            ),
+            ToolMessage(content="Berhasil menyimpan pengeluaran.", tool_call_id=call_id, name="save_expense", id=str(uuid.uuid4())),
+            AIMessage(content="Pengeluaran nasi ayam sudah dicatat di kategori Makanan.", id=str(uuid.uuid4())),
+        ]
+    return messages
+
+def timeit(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), sorted(samples)[int(len(samples) * 0.95) - 1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--db", action="store_true")
+    parser.add_argument("--images", type=int, default=0, help="Jumlah foto per giliran (0 = history teks saja).")
+    parser.add_argument("--image-size", type=int, default=150_000, help="Ukuran tiap foto dalam byte.")
+    args = parser.parse_args()
+
+    raw_messages = build_history(args.turns, args.images, args.image_size)
+    plain = json.dumps(messages_to_dict(raw_messages)).encode("utf-8")
+    # save_memory strips image payloads before serializing, so measure what is actually stored
+    messages = strip_images(raw_messages)
+    payload = serialize_messages(messages)
+    print(f"{len(messages)} messages: plain json {len(plain)} B, stored {len(payload)} B")
+    if args.images:
+        p50, p95 = timeit(lambda: strip_images(raw_messages), args.rounds)
+        print(f"strip_images p50={p50:.3f}ms p95={p95:.3f}ms")
+
+    p50, p95 = timeit(lambda: serialize_messages(messages), args.rounds)
+    print(f"serialize   p50={p50:.3f}ms p95={p95:.3f}ms")
+    p50, p95 = timeit(lambda: deserialize_messages(payload), args.rounds)
+    print(f"deserialize p50={p50:.3f}ms p95={p95:.3f}ms")
+
+    if args.db:
+        from app.services.memory import _cache, load_memory, save_memory
+        chat_id = -int(time.time())
+        _, version = load_memory(chat_id)
+        version = save_memory(chat_id, raw_messages, version, raw_messages)
+
+        p50, p95 = timeit(lambda: load_memory(chat_id), args.rounds)
+        print(f"load (cache hit)  p50={p50:.3f}ms p95={p95:.3f}ms")
+
+        def cold_load():
+            _cache.clear()
+            load_memory(chat_id)
+        p50, p95 = timeit(cold_load, args.rounds)
+        print(f"load (cache miss) p50={p50:.3f}ms p95={p95:.3f}ms")
+
+        def turn():
+            nonlocal version
+            version = save_memory(chat_id, raw_messages, version, [])
+        p50, p95 = timeit(turn, args.rounds)
+        print(f"save              p50={p50:.3f}ms p95={p95:.3f}ms")
+
+        from app.db.database import get_db_connection
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM chat_memory WHERE chat_id = %s", (chat_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
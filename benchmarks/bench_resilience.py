@@ -0,0 +1,183 @@
+"""
+Benchmark ResilientCaller terhadap fake model dengan latency & error yang disuntikkan.
+
+Jalankan dari root repo:
+    python -m benchmarks.bench_resilience
+
+Sebelum benchmark, fungsi check_* memverifikasi perilaku breaker, deadline dan hedging (assert).
+"""
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.services.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+class FakeModel:
+    """ Latency normal ~base, sebagian lambat (tail), sebagian error, sebagian hang. """
+    def __init__(self, base=0.05, slow_rate=0.05, slow=1.0, error_rate=0.03, hang_rate=0.01, hang=5.0, seed=0):
+        self.base, self.slow_rate, self.slow = base, slow_rate, slow
+        self.error_rate, self.hang_rate, self.hang = error_rate, hang_rate, hang
+        self.rng = random.Random(seed)
+        self.healthy = True
+
+    def invoke(self, messages):
+        roll = self.rng.random()
+        if not self.healthy:
+            time.sleep(self.base)
+            raise ConnectionError("upstream unavailable")
+        if roll < self.error_rate:
+            time.sleep(self.base)
+            raise ConnectionError("503 Service Unavailable")
+        if roll < self.error_rate + self.hang_rate:
+            time.sleep(self.hang)
+        elif roll < self.error_rate + self.hang_rate + self.slow_rate:
+            time.sleep(self.slow)
+        else:
+            time.sleep(self.rng.lognormvariate(0, 0.3) * self.base)
+        return "ok"
+
+def run(call, n, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        try:
+            call()
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(one, range(n)))
+
+def report(name, results):
+    lat = sorted(r[0] * 1000 for r in results)
+    pct = lambda p: lat[max(int(len(lat) * p) - 1, 0)]
+    errors = sum(1 for r in results if not r[1])
+    print(f"{name:<10} p50={statistics.median(lat):7.0f}ms p95={pct(0.95):7.0f}ms p99={pct(0.99):7.0f}ms max={lat[-1]:7.0f}ms errors={errors}/{len(lat)}")
+
+class Recorder:
+    """ Fungsi palsu yang mencatat waktu mulai setiap pemanggilan. """
+    def __init__(self, durations=(), fail=False):
+        self.durations = list(durations)
+        self.fail = fail
+        self.starts = []
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.starts.append(time.monotonic())
+            duration = self.durations.pop(0) if self.durations else 0.0
+        time.sleep(duration)
+        if self.fail:
+            raise ConnectionError("503 Service Unavailable")
+        return "ok"
+
+def check_breaker_opens():
+    caller = ResilientCaller(max_retries=0, hedge=False, breaker=CircuitBreaker(threshold=3, cooldown=60))
+    fn = Recorder(fail=True)
+    for _ in range(3):
+        try:
+            caller.call(fn)
+        except ConnectionError:
+            pass
+    assert caller.breaker.is_open and len(fn.starts) == 3
+    try:
+        caller.call(fn)
+        raise AssertionError("call went through an open breaker")
+    except CircuitOpenError:
+        pass
+    assert len(fn.starts) == 3, "open breaker must not reach upstream"
+
+def check_half_open():
+    caller = ResilientCaller(max_retries=0, hedge=False, breaker=CircuitBreaker(threshold=1, cooldown=0.1))
+    try:
+        caller.call(Recorder(fail=True))
+    except ConnectionError:
+        pass
+    time.sleep(0.15)
+
+    fn = Recorder(durations=[0.2])
+    barrier = threading.Barrier(8)
+    outcomes = []
+    def one():
+        barrier.wait()
+        try:
+            outcomes.append(caller.call(fn))
+        except CircuitOpenError:
+            outcomes.append("open")
+    threads = [threading.Thread(target=one) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(fn.starts) == 1, f"half-open let {len(fn.starts)} calls through"
+    assert outcomes.count("ok") == 1 and outcomes.count("open") == 7
+    assert not caller.breaker.is_open, "successful probe must close the breaker"
+
+def check_deadline():
+    caller = ResilientCaller(timeout=0.2, deadline=0.5, max_retries=50, base_delay=0.01, hedge=False, breaker=CircuitBreaker(threshold=100))
+    fn = Recorder(durations=[1.0] * 50)
+    start = time.monotonic()
+    try:
+        caller.call(fn)
+        raise AssertionError("hung upstream must time out")
+    except TimeoutError:
+        pass
+    elapsed = time.monotonic() - start
+    assert elapsed < 0.5 + 0.1, f"retries ran past the deadline ({elapsed:.2f}s)"
+    assert len(fn.starts) < 50, "retries must stop at the deadline, not at max_retries"
+
+def check_hedge():
+    caller = ResilientCaller(timeout=2.0, hedge=True, hedge_percentile=0.95, hedge_min_delay=0.05)
+    caller.latencies.extend([0.1] * 20)
+    assert abs(caller.hedge_delay() - 0.1) < 1e-9
+
+    # Fast first attempt: no hedge
+    fn = Recorder(durations=[0.02])
+    caller.call(fn)
+    assert len(fn.starts) == 1, "hedge fired before hedge_delay"
+
+    # Slow first attempt: hedge fires after hedge_delay and wins
+    fn = Recorder(durations=[1.0, 0.01])
+    start = time.monotonic()
+    caller.call(fn)
+    assert len(fn.starts) == 2, "hedge did not fire"
+    gap = fn.starts[1] - fn.starts[0]
+    assert gap >= 0.1 - 0.01, f"hedge fired after {gap:.3f}s, before hedge_delay"
+    assert time.monotonic() - start < 0.5, "hedged attempt should win"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    logging.getLogger("app.services.resilience").setLevel(logging.ERROR)
+
+    for check in (check_breaker_opens, check_half_open, check_deadline, check_hedge):
+        check()
+        print(f"{check.__name__} ok")
+
+    model = FakeModel()
+    report("bare", run(lambda: model.invoke([]), args.calls, args.concurrency))
+
+    caller = ResilientCaller(timeout=0.5, deadline=2.0, max_retries=2, base_delay=0.02, hedge=True, hedge_min_delay=0.05, max_workers=64)
+    warmup = FakeModel(seed=1)
+    run(lambda: caller.call(lambda: warmup.invoke([])), 50, args.concurrency)
+    print(f"hedge delay after warmup: {caller.hedge_delay() * 1000:.0f}ms")
+    model = FakeModel()
+    report("resilient", run(lambda: caller.call(lambda: model.invoke([])), args.calls, args.concurrency))
+
+    # Outage: breaker should open and fail fast
+    caller.breaker = CircuitBreaker(threshold=5, cooldown=1.0)
+    model.healthy = False
+    results = run(lambda: caller.call(lambda: model.invoke([])), 100, 1)
+    report("outage", results)
+    try:
+        caller.call(lambda: model.invoke([]))
+    except CircuitOpenError:
+        print("circuit open: failing fast")
+
+if __name__ == "__main__":
+    main()
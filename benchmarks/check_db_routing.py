@@ -0,0 +1,82 @@
+"""
+Cek routing read/write terhadap dua instance Postgres lokal (primary & replica).
+
+Contoh (primary di 5432, replica/instance kedua di 5433):
+    POSTGRES_HOST=localhost POSTGRES_READ_HOST=localhost POSTGRES_READ_PORT=5433 \
+        python -m benchmarks.check_db_routing
+Hentikan instance kedua lalu jalankan lagi untuk melihat fallback ke primary.
+"""
+import asyncio
+import time
+from app.config import DB_PORT, DB_READ_PORT, READ_YOUR_WRITES_WINDOW
+import app.db.database as db
+from app.services.memory import _cache, load_memory, save_memory
+
+def server_port() -> str:
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT current_setting('port')")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+async def async_server_port() -> str:
+    pool = await db.get_async_pool()
+    return await pool.fetchval("SELECT current_setting('port')")
+
+def replica_port() -> str:
+    # After a failed replica connection the router falls back to the primary
+    return DB_PORT if time.monotonic() < db._replica_down_until else DB_READ_PORT
+
+def check(name, got, expected):
+    status = "OK  " if str(got) == str(expected) else "FAIL"
+    print(f"{status} {name:<40} port={got} (expected {expected})")
+
+async def main():
+    print(f"primary port={DB_PORT}, replica port={DB_READ_PORT}")
+    check("default (write)", server_port(), DB_PORT)
+    with db.route(db.READ, 1):
+        check("read, chat 1", server_port(), replica_port())
+        check("read, chat 1 (async)", await async_server_port(), replica_port())
+    with db.route(db.PRIMARY, 1):
+        check("primary read, chat 1", server_port(), DB_PORT)
+    with db.route(db.READ, 1):
+        check("read after primary read, chat 1", server_port(), replica_port())
+    with db.route(db.WRITE, 1):
+        check("write, chat 1", server_port(), DB_PORT)
+        db.mark_write(1)  # what a write tool does after its commit
+    with db.route(db.READ, 1):
+        check("read right after write, chat 1", server_port(), DB_PORT)
+        check("read right after write, chat 1 (async)", await async_server_port(), DB_PORT)
+    with db.route(db.READ, 2):
+        check("read, other chat", server_port(), replica_port())
+
+    # Another worker wrote for this chat: simulate it by forgetting local writes after saving memory
+    chat_id = -int(time.time())
+    save_memory(chat_id, [], 0, [], wrote=True)
+    db._last_write.clear()
+    _cache.clear()
+    with db.route(db.READ, chat_id):
+        check("read after other worker's write", server_port(), replica_port())
+    load_memory(chat_id)
+    with db.route(db.READ, chat_id):
+        check("read after other worker's write (loaded)", server_port(), DB_PORT)
+
+    time.sleep(READ_YOUR_WRITES_WINDOW + 0.1)
+    with db.route(db.READ, 1):
+        check("read after window, chat 1", server_port(), replica_port())
+    with db.route(db.READ, chat_id):
+        check("read after window, other worker's chat", server_port(), replica_port())
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM chat_memory WHERE chat_id = %s", (chat_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    await db.close_async_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
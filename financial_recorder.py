@@ -1,16 +1,21 @@
 import os
+import argparse
+import asyncio
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import json
 import base64
 from typing import List, Annotated, TypedDict, Union
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage, RemoveMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import MessagesState, add_messages
 import operator
 from dotenv import load_dotenv
+from app.services.categories import get_category_index
 
 llm = "gemini-2.5-flash-lite"
 
@@ -65,6 +70,7 @@ def init_db():
     """)
     # Add column if it doesn't exist (for existing DBs)
     cursor.execute("ALTER TABLE pengeluaran ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    cursor.execute("ALTER TABLE pengeluaran ADD COLUMN IF NOT EXISTS chat_id BIGINT")
     conn.commit()
     cursor.close()
     conn.close()
@@ -74,13 +80,13 @@ class BasicToolNode:
     def __init__(self, tools: list):
         self.tools_by_name = {tool.name: tool for tool in tools}
 
-    def __call__(self, state: dict):
+    def __call__(self, state: dict, config: RunnableConfig):
         messages = state.get("messages", [])
         last_message = messages[-1]
         outputs = []
         for tool_call in last_message.tool_calls:
             tool = self.tools_by_name[tool_call["name"]]
-            tool_output = tool.invoke(tool_call["args"])
+            tool_output = tool.invoke(tool_call["args"], config)
             outputs.append(ToolMessage(
                 content=str(tool_output),
                 tool_call_id=tool_call["id"],
@@ -90,38 +96,58 @@ class BasicToolNode:
 
 # --- Tools ---
 
+def get_chat_id(config: RunnableConfig):
+    return (config or {}).get("configurable", {}).get("chat_id")
+
 @tool
-def save_expense(items: List[dict]):
+def save_expense(items: List[dict], config: RunnableConfig):
     """
     Menyimpan data pengeluaran baru ke database.
     Input items harus berupa list of dictionaries dengan key: id, description, category, expenses.
+    Untuk data baru, kosongkan id (id dibuat oleh database); isi id hanya untuk mengubah data yang sudah ada.
     """
     if isinstance(items, str):
         items = json.loads(items)
+    chat_id = get_chat_id(config)
         
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
+        # Same category resolver as the bot, so backfilled rows don't re-create merged duplicates
+        index = get_category_index()
+
+        # New rows get MAX(id) + 1 under a table lock, so concurrent turns (and the bot) can't pick the same id
+        if any(item.get("id") is None for item in items):
+            cursor.execute("LOCK TABLE pengeluaran IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM pengeluaran")
+            next_id = cursor.fetchone()[0]
+            for item in items:
+                if item.get("id") is None:
+                    next_id += 1
+                    item["id"] = next_id
+
+        categories = []
         for item in items:
-            category = item.get("category", "Lain-lain")
-            if category:
-                category = category.strip().title()
+            category = index.resolve(item.get("category") or "Lain-lain")
+            categories.append(category)
             
             # Use provided date or CURRENT_TIMESTAMP
             date_val = item.get("date") # Expected format: 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'
             
             if date_val:
                 cursor.execute(
-                    "INSERT INTO pengeluaran (id, description, category, expenses, created_at) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses, created_at = EXCLUDED.created_at",
-                    (item.get("id"), item.get("description"), category, item.get("expenses"), date_val)
+                    "INSERT INTO pengeluaran (id, description, category, expenses, chat_id, created_at) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses, created_at = EXCLUDED.created_at WHERE pengeluaran.chat_id IS NOT DISTINCT FROM EXCLUDED.chat_id",
+                    (item.get("id"), item.get("description"), category, item.get("expenses"), chat_id, date_val)
                 )
             else:
                 cursor.execute(
-                    "INSERT INTO pengeluaran (id, description, category, expenses) VALUES (%s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses",
-                    (item.get("id"), item.get("description"), category, item.get("expenses"))
+                    "INSERT INTO pengeluaran (id, description, category, expenses, chat_id) VALUES (%s, %s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET description = EXCLUDED.description, category = EXCLUDED.category, expenses = EXCLUDED.expenses WHERE pengeluaran.chat_id IS NOT DISTINCT FROM EXCLUDED.chat_id",
+                    (item.get("id"), item.get("description"), category, item.get("expenses"), chat_id)
                 )
         conn.commit()
-        return "Berhasil menyimpan pengeluaran."
+        for category in categories:
+            index.add(category)
+        return f"Berhasil menyimpan pengeluaran (id: {', '.join(str(item.get('id')) for item in items)})."
     except Exception as e:
         return f"Gagal menyimpan: {str(e)}"
     finally:
@@ -153,16 +179,16 @@ def get_expense_by_category():
     return "\n".join([f"- {row[0]}: {row[1]}" for row in rows])
 
 @tool
-def get_recent_expenses():
-    """ Mengambil data pengeluaran terakhir untuk menentukan ID berikutnya. """
+def get_recent_expenses(config: RunnableConfig):
+    """ Mengambil data pengeluaran terakhir chat ini (misalnya untuk mengoreksi data yang baru disimpan). """
     conn = get_db_connection()
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT id, description, category, expenses FROM pengeluaran ORDER BY id DESC LIMIT 1")
+    cursor.execute("SELECT id, description, category, expenses FROM pengeluaran WHERE chat_id IS NOT DISTINCT FROM %s ORDER BY id DESC LIMIT 1", (get_chat_id(config),))
     row = cursor.fetchone()
     cursor.close()
     conn.close()
     if not row:
-        return json.dumps({"status": "empty", "last_id": 0})
+        return json.dumps({"status": "empty"})
     return json.dumps({"status": "exists", "id": row["id"], "description": row["description"], "category": row["category"], "expenses": float(row["expenses"])})
 
 @tool
@@ -235,9 +261,8 @@ def call_model(state: State):
 Your task is to process user input about expenses and prepare it to be stored in the database.
 
 ### Instructions:
-1. Sebelum membuat data baru, gunakan **get_recent_expenses** untuk mendapatkan `id` terakhir.
-   - Jika belum ada data (last_id=0), mulai dari id = 1.
-   - Jika ada data, id baru = last_id + 1.
+1. Untuk data baru, JANGAN isi `id`; id dibuat otomatis oleh database saat **save_expense**.
+   - Isi `id` hanya untuk mengubah data yang sudah ada (gunakan **get_recent_expenses** untuk melihat data terakhir).
 2. Gunakan **get_categories** untuk melihat kategori yang sudah pernah digunakan. 
    **PENTING:** Jika input user memiliki arti yang mirip dengan kategori yang sudah ada (misal: 'perlengkapan rumah' mirip dengan 'Peralatan Rumah Tangga'), gunakan kategori yang SUDAH ADA agar konsisten.
 3. Parse input user menjadi structured items. Gunakan format **Title Case** untuk kategori.
@@ -327,7 +352,7 @@ async def get_agent_response(
     final_text = ""
     last_state = inputs
 
-    async for output in app.astream(inputs):
+    async for output in app.astream(inputs, {"configurable": {"chat_id": chat_id}}):
         for node_name, node_output in output.items():
             if "messages" in node_output:
                 # Accumulate messages for manual persistence
@@ -346,17 +371,96 @@ async def get_agent_response(
 
 
 
+# --- Batch / replay mode ---
+
+def load_batch(path):
+    """
+    Membaca file JSONL berisi pesan. Setiap baris:
+    {"chat_id": 1, "text": "beli kopi 20rb"} atau {"chat_id": 1, "image": "nota.jpg"}
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "text" not in record and "image" not in record:
+                raise ValueError(f"Baris {line_no}: butuh key 'text' atau 'image'.")
+            record.setdefault("chat_id", 0)
+            records.append(record)
+    return records
+
+async def process_record(record, semaphore):
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            if record.get("image"):
+                with open(record["image"], "rb") as f:
+                    reply = await get_agent_response(f.read(), chat_id=record["chat_id"], is_image=True)
+            else:
+                reply = await get_agent_response(record["text"], chat_id=record["chat_id"])
+            error = None
+        except Exception as e:
+            reply, error = "", str(e)
+        return {**record, "reply": reply, "error": error, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+async def run_batch(input_path, output_path, concurrency):
+    """
+    Memproses pesan dari file JSONL secara concurrent (maksimal `concurrency` sekaligus).
+    Pesan dalam chat_id yang sama tetap diproses berurutan agar memory percakapan konsisten.
+    Baris disimpan dengan chat_id dari record, jadi ikut terbaca oleh budget/insight per chat di bot.
+    """
+    records = load_batch(input_path)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    chats = {}
+    for idx, record in enumerate(records):
+        chats.setdefault(record["chat_id"], []).append(idx)
+
+    results = [None] * len(records)
+    async def run_chat(indices):
+        for idx in indices:
+            results[idx] = await process_record(records[idx], semaphore)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_chat(indices) for indices in chats.values()])
+    elapsed = time.perf_counter() - start
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    latencies = sorted(r["elapsed_ms"] for r in results)
+    errors = sum(1 for r in results if r["error"])
+    print(f"Processed {len(results)} messages from {len(chats)} chats in {elapsed:.2f}s "
+          f"({len(results) / elapsed if elapsed else 0:.2f} msg/s, concurrency={concurrency}).")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+        print(f"Latency p50={p50:.0f}ms p95={p95:.0f}ms max={latencies[-1]:.0f}ms, errors={errors}.")
+    print(f"Replies written to {output_path}.")
+
+
 if __name__ == "__main__":
-    import asyncio
+    parser = argparse.ArgumentParser(description="Financial Recorder LangGraph (Postgres).")
+    parser.add_argument("--batch", metavar="INPUT_JSONL", help="Proses pesan dari file JSONL alih-alih mode interaktif.")
+    parser.add_argument("--output", default="batch_output.jsonl", help="File JSONL untuk balasan dan timing (default: batch_output.jsonl).")
+    parser.add_argument("--concurrency", type=int, default=4, help="Jumlah pesan yang diproses bersamaan (default: 4).")
+    args = parser.parse_args()
+
     init_db()
-    print("Financial Recorder LangGraph (Postgres) Active.")
-    async def cli():
-        while True:
-            raw = input("User: ")
-            if raw.lower() == "exit": break
-            if raw.endswith((".jpg", ".png", ".jpeg")) and os.path.exists(raw):
-                with open(raw, "rb") as f:
-                    print(f"Agent: {await get_agent_response(f.read(), chat_id=0, is_image=True)}")
-            else:
-                print(f"Agent: {await get_agent_response(raw, chat_id=0)}")
-    asyncio.run(cli())
+    if args.batch:
+        asyncio.run(run_batch(args.batch, args.output, max(args.concurrency, 1)))
+    else:
+        print("Financial Recorder LangGraph (Postgres) Active.")
+        async def cli():
+            while True:
+                raw = input("User: ")
+                if raw.lower() == "exit": break
+                if raw.endswith((".jpg", ".png", ".jpeg")) and os.path.exists(raw):
+                    with open(raw, "rb") as f:
+                        print(f"Agent: {await get_agent_response(f.read(), chat_id=0, is_image=True)}")
+                else:
+                    print(f"Agent: {await get_agent_response(raw, chat_id=0)}")
+        asyncio.run(cli())
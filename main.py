@@ -3,7 +3,7 @@ import uvicorn
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from app.api.webhook import router
-from app.db.database import init_db
+from app.db.database import init_db, close_async_pool
 from app.bot.handlers import bot
 from app.config import WEBHOOK_URL, WEBHOOK_SECRET
 
@@ -21,7 +21,8 @@ async def lifespan(app: FastAPI):
         logger.info(f"Webhook set to: {webhook_path}")
     logger.info("Bot started and DB initialized.")
     yield
-    # Shutdown logic (optional)
+    # Shutdown logic
+    await close_async_pool()
     logger.info("Bot shutting down.")
 
 app = FastAPI(lifespan=lifespan)